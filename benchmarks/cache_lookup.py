@@ -0,0 +1,68 @@
+#!/usr/bin/python
+"""
+Micro-benchmark for module_utils Cache lookups. Populates the cache with
+elements spread over a few types and times resolving every element by
+name, compared to the linear scan of the type list the cache previously
+used.
+
+    python benchmarks/cache_lookup.py --entries 10000
+"""
+import os
+import sys
+import time
+import argparse
+import collections
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils'))
+
+from stonesoft_util import Cache
+
+
+Element = collections.namedtuple('Element', 'name href typeof')
+
+TYPES = ('host', 'network', 'address_range', 'group')
+
+
+def linear_get(cache, typeof, name):
+    for value in cache.cache.get(typeof, []):
+        if value.name == name:
+            return value
+
+
+def populate(entries):
+    cache = Cache()
+    names = []
+    for i in range(entries):
+        typeof = TYPES[i % len(TYPES)]
+        name = '%s-%d' % (typeof, i)
+        cache._store(typeof, Element(
+            name, 'http://smc/6.4/elements/%s/%d' % (typeof, i), typeof))
+        names.append((typeof, name))
+    return cache, names
+
+
+def timed(func, cache, names):
+    start = time.time()
+    for typeof, name in names:
+        assert func(cache, typeof, name) is not None
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--entries', type=int, default=10000)
+    args = parser.parse_args()
+
+    cache, names = populate(args.entries)
+    indexed = timed(lambda c, t, n: c.get(t, n), cache, names)
+    linear = timed(linear_get, cache, names)
+
+    print('%d entries, %d lookups' % (args.entries, len(names)))
+    print('%-14s %10.4fs' % ('linear scan', linear))
+    print('%-14s %10.4fs' % ('indexed', indexed))
+    print('%-14s %10.1fx' % ('speedup', linear / max(indexed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
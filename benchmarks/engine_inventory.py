@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""
+Benchmark the number of HTTP requests made by engine_facts when exporting
+engines in YAML format, serializing each engine on its own (as_yaml) and
+with the shared prefetch cache of the fleet mode, serially and with a
+worker pool. The mock SMC holds firewalls that each have zones, netlinks,
+BGP peerings, categories, a log server, a location and an SNMP agent.
+
+Requires ansible and smc-python to be installed::
+
+    python benchmarks/engine_inventory.py --engines 200 --workers 8
+"""
+import os
+import sys
+import time
+import argparse
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(os.path.dirname(here), 'library'))
+sys.path.insert(0, os.path.join(os.path.dirname(here), 'module_utils'))
+
+import stonesoft_util
+sys.modules['ansible.module_utils.stonesoft_util'] = stonesoft_util
+
+from mock_smc import MockSMC
+from fixtures import populate_engines
+
+
+def requests(smc):
+    return sum(v for k, v in smc.counters.items() if ' ' in k)
+
+
+def export(smc, fleet, workers=1):
+    import engine_facts
+    from smc.base.collection import Search
+    engines = list(Search.objects.context_filter('engine_clusters'))
+    smc.counters.clear()
+    start = time.time()
+    if fleet:
+        cache = engine_facts.EngineCache(max_concurrency=workers)
+        cache.prefetch()
+        result = [data for data, _ in cache.serialize(engines)]
+    else:
+        result = [engine_facts.to_yaml(engine) for engine in engines]
+    return result, requests(smc), time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--engines', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8,
+                        help='smc_max_concurrency for the concurrent fleet export')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds added to each mock SMC response')
+    args = parser.parse_args()
+
+    from smc import session
+
+    smc = MockSMC(latency=args.latency)
+    populate_engines(smc, args.engines)
+    smc.start()
+    runs = []
+    try:
+        for label, fleet, workers in (
+            ('per engine', False, 1),
+            ('fleet', True, 1),
+            ('fleet x%d' % args.workers, True, args.workers)):
+            session.login(url=smc.url, api_key='benchmark', api_version='6.4')
+            runs.append((label,) + export(smc, fleet, workers))
+            session.logout()
+    finally:
+        smc.stop()
+
+    for run in runs[1:]:
+        assert run[1] == runs[0][1], '%s export differs from per engine export' % run[0]
+    print('%d engines, %.3fs latency' % (args.engines, args.latency))
+    print('%-12s %9s %12s %8s' % ('', 'requests', 'per engine', 'seconds'))
+    for label, _, count, seconds in runs:
+        print('%-12s %9d %12.2f %8.2f' % (
+            label, count, count / float(args.engines), seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Data sets for the mock SMC. Each function adds elements to a
+:class:`mock_smc.MockSMC` in the format returned by the SMC API so the
+modules can run against it unmodified.
+"""
+
+
+def routing_node(smc, name, level, typeof, children=(), href=None, **data):
+    node = dict(
+        name=name, level=level, related_element_type=typeof,
+        routing_node=list(children), href=href,
+        link=[dict(rel='self', href=smc.href('routing', name))])
+    node.update(data)
+    return node
+
+
+def populate_elements(smc, size):
+    """
+    Add `size` hosts and networks, size / 10 groups of 10 hosts each and
+    `size` TCP services.
+
+    :return: dict of typeof: list of hrefs
+    """
+    hosts = [smc.add_element('host', 'host-%d' % i,
+             address='10.%d.%d.%d' % (i // 65536 % 256, i // 256 % 256, i % 256))
+             for i in range(size)]
+    networks = [smc.add_element('network', 'network-%d' % i,
+                ipv4_network='172.%d.%d.0/24' % (16 + i // 256 % 16, i % 256))
+                for i in range(size)]
+    groups = [smc.add_element('group', 'group-%d' % i, element=hosts[i * 10:i * 10 + 10])
+              for i in range(size // 10)]
+    services = [smc.add_element('tcp_service', 'tcp-%d' % i,
+                min_dst_port=1024 + i, max_dst_port=1024 + i)
+                for i in range(size)]
+    return dict(host=hosts, network=networks, group=groups, tcp_service=services)
+
+
+def populate_policy(smc, name, rules, elements):
+    """
+    Add a firewall policy with `rules` IPv4 access rules. Each rule refers
+    to a few of the elements returned by :func:`populate_elements`, so
+    elements are shared between rules like in a real policy. Rule tags
+    are the rule id followed by the revision, as in the SMC, and rules
+    can be found by tag with the search_rule link of the policy.
+
+    :return: href of the policy
+    """
+    policy = smc.add_element('fw_policy', name)
+    hosts, networks = elements['host'], elements['network']
+    services = elements['tcp_service']
+    meta = []
+    by_tag = {}
+    for i in range(rules):
+        rule = smc.add_element(
+            'fw_ipv4_access_rule', 'rule-%d' % i,
+            rank=float(i),
+            is_disabled=False,
+            comment='rule %d' % i,
+            sources=dict(src=[hosts[i % len(hosts)], networks[i % len(networks)]]),
+            destinations=dict(dst=[networks[(i + 1) % len(networks)]]),
+            services=dict(service=[services[i % len(services)]]),
+            action=dict(action=['allow'], connection_tracking_options={}),
+            authentication_options=dict(require_auth=False, methods=[], users=[]),
+            options=dict(log_level='undefined'))
+        key = rule.rsplit('/', 1)[-1]
+        smc.elements[rule]['tag'] = '%s.1' % key
+        meta.append(smc.meta(rule))
+        by_tag['@' + key] = meta[-1]
+
+    def search_rule(method, body, query):
+        found = by_tag.get(query.get('filter'))
+        return {'result': [found] if found else []}
+
+    smc.add_link(policy, 'fw_ipv4_access_rules', {'result': meta})
+    smc.add_link(policy, 'search_rule', search_rule)
+    return policy
+
+
+def populate_engines(smc, engines, interfaces=4, zones=20, categories=10, vpns=4,
+                     routes=100, policy=None):
+    """
+    Add single firewalls and the elements they reference. Shared elements
+    are spread over the engines so each engine references a few of each
+    type. Engines have pending changes if their number is divisible by 10.
+    Each engine resolves an ip and net alias per interface and has a routing
+    table of `routes` static /24 routes, a default route and a connected
+    route per interface. Each engine is a gateway of a policy VPN with a VPN
+    site of two networks shared with other sites. The first gateway of
+    each VPN is the hub and has a tunnel to each satellite. The last
+    satellite of each VPN is an external gateway without sites.
+
+    :param str policy: name of the policy installed on the engines
+    :return: list of engine hrefs
+    """
+    zone_refs = [smc.add_element('interface_zone', 'zone-%d' % i)
+                 for i in range(zones)]
+    log_server = smc.add_element('log_server', 'LogServer 10.0.0.1')
+    location = smc.add_element('location', 'datacenter')
+    snmp_agent = smc.add_element('snmp_agent', 'snmp-agent')
+    peer = smc.add_element('external_bgp_peer', 'isp-peer')
+    peering = smc.add_element('bgp_peering', 'isp-peering')
+    router = smc.add_element('router', 'isp-gw')
+    netlink = smc.add_element('netlink', 'isp-netlink')
+    tags = [smc.add_element('category_tag', 'tag-%d' % i)
+            for i in range(categories)]
+    members = dict((tag, []) for tag in tags)
+    profile = smc.add_element('vpn_profile', 'VPN-A Suite')
+    vpn_refs = [smc.add_element('vpn', 'vpn-%d' % i, mobile_vpn_topology_mode='None',
+                                vpn_profile=profile, nat=False)
+                for i in range(vpns)]
+    site_networks = [smc.add_element('network', 'site-network-%d' % i,
+                     ipv4_network='192.168.%d.0/24' % i) for i in range(10)]
+    vpn_nodes = dict((vpn, []) for vpn in vpn_refs)
+    aliases = [(smc.add_element('alias', '$$ Interface ID %d.ip' % nicid),
+                smc.add_element('alias', '$$ Interface ID %d.net' % nicid))
+               for nicid in range(interfaces)]
+    hrefs = []
+
+    for i in range(engines):
+        name = 'fw-%d' % i
+        physical = []
+        for nicid in range(interfaces):
+            address = '10.%d.%d.1' % (i % 250, nicid)
+            physical.append({'physical_interface': dict(
+                interface_id=str(nicid),
+                zone_ref=zone_refs[(i + nicid) % zones],
+                interfaces=[{'single_node_interface': dict(
+                    address=address, network_value='%s/24' % address[:-2] + '.0',
+                    nicid=str(nicid), nodeid=1, primary_mgt=nicid == 0)}],
+                link=[dict(rel='self', href=smc.href('interface', name, str(nicid)))])})
+
+        node = smc.href('node', name)
+        smc.add_resource(node + '/status', dict(
+            configuration_status='Installed', dyn_up='1000', installed_policy=policy,
+            name='%s node 1' % name, platform='x86-64-small', state='READY',
+            status='Online', version='6.4.0', engine_node_status=None,
+            monitoring_state=None, monitoring_status=None))
+
+        href = smc.add_element(
+            'single_fw', name,
+            physicalInterfaces=physical,
+            nodes=[{'firewall_node': dict(name='%s node 1' % name, nodeid=1, link=[
+                dict(rel='self', href=node, type='firewall_node'),
+                dict(rel='status', href=node + '/status')])}],
+            location_ref=location,
+            log_server_ref=log_server,
+            snmp_agent_ref=snmp_agent,
+            snmp_location='rack-%d' % i,
+            snmp_interface=[],
+            domain_server_address=[dict(rank=0, value='8.8.8.8')],
+            default_nat=False,
+            antivirus=dict(antivirus_enabled=False),
+            gti_settings=dict(file_reputation_context='disabled'),
+            dynamic_routing=dict(bgp=dict(enabled=False, router_id=None)))
+        hrefs.append(href)
+
+        gateways = [
+            routing_node(smc, 'isp-peering', 'gateway', 'bgp_peering', href=peering,
+                children=[routing_node(smc, 'isp-peer', 'any', 'external_bgp_peer',
+                                       href=peer)]),
+            routing_node(smc, 'isp-netlink', 'gateway', 'netlink', href=netlink,
+                children=[routing_node(smc, 'isp-gw', 'any', 'router', href=router)])]
+        network = routing_node(
+            smc, 'network-10.%d.0.0/24' % (i % 250), 'network', 'network',
+            children=gateways, ip='10.%d.0.0/24' % (i % 250))
+        smc.add_link(href, 'routing', routing_node(
+            smc, name, 'engine_cluster', 'single_fw', children=[
+                routing_node(smc, 'Interface 0', 'interface', 'physical_interface',
+                    children=[network], nic_id='0')]))
+        smc.add_link(href, 'alias_resolving', [entry
+            for nicid, (ip_alias, net_alias) in enumerate(aliases)
+            for entry in (
+                dict(alias_ref=ip_alias, resolved_value=['10.%d.%d.1' % (i % 250, nicid)]),
+                dict(alias_ref=net_alias, resolved_value=['10.%d.%d.0/24' % (i % 250, nicid)]))])
+        table = [dict(route_network='0.0.0.0', route_netmask=0, route_type='Static',
+                      route_gateway='10.%d.0.254' % (i % 250), dst_if=0, src_if=-1)]
+        table.extend(dict(route_network='10.%d.%d.0' % (i % 250, nicid), route_netmask=24,
+                          route_type='Connected', dst_if=nicid, src_if=-1)
+                     for nicid in range(interfaces))
+        table.extend(dict(route_network='172.%d.%d.0' % (16 + r // 256 % 16, r % 256),
+                          route_netmask=24, route_type='Static', dst_if=r % interfaces,
+                          route_gateway='10.%d.%d.254' % (i % 250, r % interfaces),
+                          src_if=-1, cluster_ref=href)
+                     for r in range(routes))
+        smc.add_link(href, 'routing_monitoring', {'routing_monitoring_entry': table})
+        smc.add_link(href, 'nodes', {'result': []})
+        smc.add_link(href, 'interfaces', {'result': []})
+        smc.add_link(href, 'pending_changes', {'result': [dict(
+            approved_on='', changed_on='2018-01-01 00:00:00 (GMT)', element=href,
+            event_type='stonegate.object.update', modifier='admin')] if i % 10 == 0 else []})
+        smc.add_task(href, 'refresh')
+        smc.add_task(href, 'upload')
+
+        gateway = smc.add_element('internal_gateway', '%s - Primary' % name)
+        smc.add_link(href, 'internal_gateway', [smc.meta(gateway)])
+        vpn = vpn_refs[i % vpns]
+        node = '%s/gateway_node/%d' % (vpn, i)
+        # The first engine of each VPN is its central gateway
+        usage = 'central_gateway_node_ref' if i < vpns else 'satellite_gateway_node_ref'
+        smc.add_link(href, 'vpn_mapping', {'vpnMappings': [{'vpn_mapping_entry': dict(
+            gateway_ref=gateway, vpn_ref=vpn, gateway_nodes_usage={usage: node})}]})
+        site = smc.add_element('vpn_site', 'Automatic Site for %s' % name,
+            site_element=[site_networks[i % 10], site_networks[(i + 1) % 10]])
+        tree_node = '%s/enabled_vpn_site/0' % node
+        smc.add_resource(tree_node, dict(vpn_site=site, link=[
+            dict(rel='self', href=tree_node, type='gateway_tree_node')]))
+        smc.add_resource(node, dict(gateway=gateway, link=[
+            dict(rel='self', href=node, type='gateway_node'),
+            dict(rel='enabled_vpn_site', href=node + '/enabled_vpn_site')]))
+        smc.add_resource(node + '/enabled_vpn_site', {'result': [dict(
+            href=tree_node, name='Automatic Site for %s' % name, type='gateway_tree_node')]})
+        vpn_nodes[vpn].append(dict(smc.meta(gateway), type='gateway_node', href=node))
+
+        engine_tags = [tags[i % categories], tags[(i + 1) % categories]]
+        smc.add_link(href, 'search_category_tags_from_element', {
+            'result': [smc.meta(tag) for tag in engine_tags]})
+        for tag in engine_tags:
+            members[tag].append(smc.meta(href))
+
+    for tag, elements in members.items():
+        smc.add_link(tag, 'search_elements_from_category_tag', {'result': elements})
+
+    partner = smc.add_element('external_gateway', 'partner-gw')
+    for vpn, nodes in vpn_nodes.items():
+        node = '%s/gateway_node/partner' % vpn
+        smc.add_resource(node, dict(gateway=partner, link=[
+            dict(rel='self', href=node, type='gateway_node'),
+            dict(rel='enabled_vpn_site', href=node + '/enabled_vpn_site')]))
+        smc.add_resource(node + '/enabled_vpn_site', {'result': []})
+        nodes.append(dict(smc.meta(partner), type='gateway_node', href=node))
+        # First node is the hub, the rest are satellites
+        smc.add_link(vpn, 'central_gateway_node', {'result': nodes[:1]})
+        smc.add_link(vpn, 'satellite_gateway_node', {'result': nodes[1:]})
+        smc.add_link(vpn, 'mobile_gateway_node', {'result': []})
+        tunnels = []
+        for number, satellite in enumerate(nodes[1:]):
+            tunnel = '%s/gateway_tunnel/%d' % (vpn, number)
+            smc.add_resource(tunnel, dict(
+                gateway_node_1=nodes[0]['href'], gateway_node_2=satellite['href'],
+                enabled=True, link=[dict(rel='self', href=tunnel, type='gateway_tunnel')]))
+            tunnels.append(dict(href=tunnel, name='tunnel-%d' % number,
+                                type='gateway_tunnel'))
+        smc.add_link(vpn, 'gateway_tunnel', {'result': tunnels})
+        smc.add_link(vpn, 'open', None)
+        smc.add_link(vpn, 'close', None)
+    return hrefs
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+"""
+Measure the import time of each module with ``python -X importtime``. Each
+module is imported in a fresh interpreter, the way ansible runs a task, and
+the time is split between ansible, smc-python, the other modules imported
+and the module itself (including stonesoft_util).
+
+Requires Python 3.7+, ansible and smc-python to be installed::
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --only engine_facts --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+
+# Import the module as ansible would, with stonesoft_util available from
+# ansible.module_utils
+BOOTSTRAP = '''
+import sys
+sys.path[:0] = [%r, %r]
+import ansible.module_utils
+import stonesoft_util
+sys.modules['ansible.module_utils.stonesoft_util'] = stonesoft_util
+import %s
+'''
+
+
+def parse(output):
+    """
+    Parse the -X importtime output into a list of (module name, self time)
+    in microseconds.
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        entries.append((name.strip(), int(self_time)))
+    return entries
+
+
+def group(name, module):
+    package = name.split('.')[0]
+    if package in ('smc', 'ansible'):
+        return package
+    if name in (module, 'stonesoft_util'):
+        return 'module'
+    return 'other'
+
+
+def measure(module, runs):
+    """
+    Import time of module in microseconds by group, the minimum of `runs`
+    interpreter starts.
+    """
+    best = None
+    for _ in range(runs):
+        code = BOOTSTRAP % (os.path.join(root, 'library'),
+                            os.path.join(root, 'module_utils'), module)
+        proc = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=root)
+        _, err = proc.communicate()
+        if proc.returncode:
+            raise RuntimeError(err.decode('utf-8', 'replace').strip().splitlines()[-1])
+        times = dict(smc=0, ansible=0, module=0, other=0, smc_modules=0, modules=0)
+        for name, self_time in parse(err.decode('utf-8', 'replace')):
+            times[group(name, module)] += self_time
+            times['modules'] += 1
+            if name.split('.')[0] == 'smc':
+                times['smc_modules'] += 1
+        times['total'] = times['smc'] + times['ansible'] + times['module'] + times['other']
+        if best is None or times['total'] < best['total']:
+            best = times
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='interpreter starts per module, the fastest is kept')
+    parser.add_argument('--only', action='append',
+                        help='only measure modules starting with this name')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    modules = sorted(name[:-3] for name in os.listdir(os.path.join(root, 'library'))
+                     if name.endswith('.py'))
+    results = {}
+    print('%-28s %9s %8s %8s %8s %8s %8s %12s' % (
+        'milliseconds', 'total', 'smc', 'ansible', 'module', 'other', 'modules',
+        'smc modules'))
+    for module in modules:
+        if args.only and not any(module.startswith(o) for o in args.only):
+            continue
+        try:
+            times = measure(module, args.runs)
+        except RuntimeError as e:
+            print('%-28s failed: %s' % (module, e))
+            continue
+        results[module] = times
+        print('%-28s %9.1f %8.1f %8.1f %8.1f %8.1f %8d %12d' % (
+            module, times['total'] / 1000.0, times['smc'] / 1000.0,
+            times['ansible'] / 1000.0, times['module'] / 1000.0,
+            times['other'] / 1000.0, times['modules'], times['smc_modules']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
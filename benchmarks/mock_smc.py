@@ -0,0 +1,319 @@
+"""
+Minimal stand-in for the Stonesoft Management Center REST API. This is
+used by the benchmarks to count the requests made by the modules without
+requiring a live SMC.
+
+Start a server in the background and point smc-python at it::
+
+    smc = MockSMC()
+    smc.add_element('host', 'myhost', address='1.1.1.1')
+    smc.start()
+    session.login(url=smc.url, api_key='xxxx')
+    ...
+    smc.stop()
+    print(smc.counters)
+"""
+import json
+import time
+import threading
+import collections
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+
+API_VERSION = '6.4'
+
+# Element types matched by the search context filters used by the modules
+CONTEXTS = {
+    'engine_clusters': ('single_fw', 'fw_cluster', 'master_engine',
+        'virtual_fw', 'single_ips', 'ips_cluster', 'single_layer2',
+        'layer2_cluster'),
+    'fw_clusters': ('single_fw', 'fw_cluster', 'virtual_fw'),
+    'ips_clusters': ('single_ips', 'ips_cluster'),
+    'layer2_clusters': ('single_layer2', 'layer2_cluster'),
+}
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockSMC(object):
+    """
+    Mock SMC server. Counters track the number of requests by method
+    and by the first path segment after the API version.
+    
+    Elements added with :meth:`add_element` are served from their own
+    href and can be listed from the entry point of their type or searched
+    with a filter and filter_context, like the SMC elements API. Elements
+    can also be created (POST to the entry point), updated (PUT) and
+    deleted. Any other JSON resource can be served with :meth:`add_resource`
+    and asynchronous operations such as a policy refresh with
+    :meth:`add_task`.
+
+    :param str host: address to bind to
+    :param int port: port to bind to, 0 for a random free port
+    :param float latency: seconds added to every response
+    :param int padding: bytes of filler added to the data of each element,
+        to simulate the size of real SMC elements
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0, padding=0):
+        self.latency = latency
+        self.padding = padding
+        self.counters = collections.Counter()
+        self.sessions = set()
+        self.elements = collections.OrderedDict() # href: data
+        self.resources = {} # href: json
+        self._ids = collections.Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadedHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self._server.server_address
+
+    def href(self, *path):
+        return '/'.join((self.url, API_VERSION) + path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def entry_points(self):
+        entry_points = [dict(rel=rel, href=self.href(rel), method='GET')
+                        for rel in ('logout', 'current_user')]
+        entry_points.append(dict(
+            rel='elements', href=self.href('elements'), method='GET'))
+        for typeof in sorted(set(
+            self._typeof(href) for href in self.elements) | set(self._ids)):
+            entry_points.append(dict(
+                rel=typeof, href=self.href('elements', typeof), method='GET'))
+        return entry_points
+    
+    def add_element(self, typeof, name, **data):
+        """
+        Add an element. Links are added as `link` entries of the element
+        with :meth:`add_link`.
+        
+        :return: href of the element
+        :rtype: str
+        """
+        with self._lock:
+            self._ids[typeof] += 1
+            key = self._ids[typeof]
+        href = self.href('elements', typeof, str(key))
+        data.update(
+            name=name,
+            key=key,
+            link=[dict(rel='self', href=href, type=typeof)])
+        if self.padding:
+            data.setdefault('padding', 'x' * self.padding)
+        self.elements[href] = data
+        return href
+    
+    def add_link(self, href, rel, value):
+        """
+        Add a link to an element that returns value when fetched.
+        
+        :return: href of the link
+        :rtype: str
+        """
+        link = '%s/%s' % (href, rel)
+        self.elements[href]['link'].append(dict(rel=rel, href=link))
+        self.add_resource(link, value)
+        return link
+    
+    def add_resource(self, href, value):
+        """
+        Serve value as JSON from href. If value is callable, it is called
+        with the request method, the request body and the query parameters
+        and the return value is served instead.
+        """
+        self.resources[href] = value
+    
+    def add_task(self, href, rel, polls=2, success=True):
+        """
+        Add a link to an element that starts a task when POSTed to, like a
+        policy upload or refresh. The follower link of the task reports the
+        task in progress for `polls` status checks before it finishes.
+        
+        :return: href of the link
+        :rtype: str
+        """
+        def start(method, body, query):
+            with self._lock:
+                self.counters['tasks'] += 1
+                follower = self.href('task', str(self.counters['tasks']))
+            remaining = [polls]
+            
+            def status(method, body, query):
+                remaining[0] -= 1
+                done = remaining[0] < 0
+                return dict(
+                    follower=follower, type=rel,
+                    in_progress=not done,
+                    success=success if done else False,
+                    last_message='Operation completed' if done else 'In progress')
+            
+            self.add_resource(follower, status)
+            return status(method, body, query)
+        return self.add_link(href, rel, start)
+    
+    def meta(self, href):
+        return dict(href=href, name=self.elements[href]['name'],
+                    type=self._typeof(href))
+    
+    def _typeof(self, href):
+        return href.split('/')[-2]
+    
+    def search(self, query, typeof=None):
+        """
+        Return the meta of elements matching the query parameters.
+        """
+        types = CONTEXTS.get(query.get('filter_context'), ())
+        if not types and query.get('filter_context'):
+            types = query['filter_context'].split(',')
+        if typeof:
+            types = (typeof,)
+        name = query.get('filter')
+        exact_match = query.get('exact_match') in ('True', 'true')
+        result = []
+        for href, data in self.elements.items():
+            if types and self._typeof(href) not in types:
+                continue
+            if name and name != data['name'] and \
+                (exact_match or name not in data['name']):
+                continue
+            result.append(self.meta(href))
+        limit = int(query.get('limit', 0))
+        return result[:limit] if limit else result
+
+    def dispatch(self, method, path, cookie, body=None):
+        """
+        Return a tuple of (status, body, headers) for the request.
+        """
+        url = urlparse(path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        parts = [p for p in url.path.split('/') if p]
+        if parts == ['api']:
+            return 200, {'version': [{'rel': API_VERSION}]}, {}
+
+        if len(parts) < 2 or parts[0] != API_VERSION:
+            return 404, None, {}
+
+        resource = parts[1]
+        self.count('%s %s' % (method, resource))
+
+        if resource in ('login', 'lms_login') and method == 'POST':
+            with self._lock:
+                self.counters['logins'] += 1
+                session_id = 'mock%d' % self.counters['logins']
+                self.sessions.add(session_id)
+            return 200, None, {'Set-Cookie': 'JSESSIONID=%s; Path=/' % session_id}
+
+        if cookie not in self.sessions:
+            return 401, None, {}
+
+        if resource == 'api':
+            return 200, {'entry_point': self.entry_points()}, {}
+        if resource == 'logout':
+            with self._lock:
+                self.counters['logouts'] += 1
+                self.sessions.discard(cookie)
+            return 204, None, {}
+        
+        href = self.href(*parts[1:])
+        if href in self.resources:
+            value = self.resources[href]
+            if callable(value):
+                value = value(method, body, query)
+            return 200, value, {}
+        
+        etag = {'ETag': '"%s"' % hash(href)}
+        if href in self.elements:
+            if method == 'GET':
+                return 200, self.elements[href], etag
+            if method == 'PUT':
+                data = self.elements[href]
+                data.update(body or {})
+                return 200, None, dict(etag, Location=href)
+            if method == 'DELETE':
+                del self.elements[href]
+                return 204, None, {}
+        
+        if method == 'GET':
+            if parts[1:] == ['elements']:
+                return 200, {'result': self.search(query)}, {}
+            if resource == 'elements' and len(parts) == 3:
+                return 200, {'result': self.search(query, parts[2])}, {}
+        if method == 'POST' and resource == 'elements' and len(parts) == 3:
+            body = dict(body or {})
+            created = self.add_element(parts[2], body.pop('name', None), **body)
+            return 201, None, {'Location': created}
+        return 404, None, {}
+
+    def _handler(self):
+        smc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _cookie(self):
+                for value in (self.headers.get('Cookie') or '').split(';'):
+                    name, _, session_id = value.strip().partition('=')
+                    if name == 'JSESSIONID':
+                        return session_id
+
+            def _respond(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = None
+                if length:
+                    try:
+                        body = json.loads(self.rfile.read(length).decode('utf-8'))
+                    except ValueError:
+                        pass
+                if smc.latency:
+                    time.sleep(smc.latency)
+                status, body, headers = smc.dispatch(
+                    method, self.path, self._cookie(), body)
+                data = json.dumps(body).encode('utf-8') if body is not None else b''
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def do_PUT(self):
+                self._respond('PUT')
+
+            def do_DELETE(self):
+                self._respond('DELETE')
+
+        return Handler
@@ -0,0 +1,222 @@
+#!/usr/bin/python
+"""
+Run the modules against a mock SMC and report the wall time, number of
+requests and peak memory of each run. Each module is run in process
+through its normal entry point (argument parsing, login, exec_module and
+logout), the same way ansible runs it.
+
+Requires ansible and smc-python to be installed::
+
+    python benchmarks/modules.py --size 500 --latency 0.002
+    python benchmarks/modules.py --only firewall_rule_facts --json results.json
+
+Compare the request counts of two runs to catch N+1 query regressions, a
+module whose requests grow with --size is fetching per element.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import collections
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(os.path.dirname(here), 'library'))
+sys.path.insert(0, os.path.join(os.path.dirname(here), 'module_utils'))
+
+import stonesoft_util
+sys.modules['ansible.module_utils.stonesoft_util'] = stonesoft_util
+
+from mock_smc import MockSMC
+from fixtures import populate_elements, populate_policy, populate_engines
+
+
+def scenarios(size, engines, tmp):
+    """
+    Module runs as tuples of (label, module, module arguments). Files
+    written by the modules go to the tmp directory.
+    """
+    return [
+        ('network_element_facts', 'network_element_facts',
+            dict(element='host')),
+        ('network_element_facts filter', 'network_element_facts',
+            dict(element='host', filter='host-1', exact_match=True)),
+        ('service_element_facts', 'service_element_facts',
+            dict(element='tcp_service')),
+        ('network_element present', 'network_element',
+            dict(elements=[{'host': dict(name='host-%d' % i, address='10.0.0.1')}
+                           for i in range(0, size, 10)])),
+        ('firewall_rule_facts', 'firewall_rule_facts',
+            dict(filter='policy')),
+        ('firewall_rule_facts as_yaml', 'firewall_rule_facts',
+            dict(filter='policy', as_yaml=True)),
+        ('firewall_rule_facts expand', 'firewall_rule_facts',
+            dict(filter='policy', as_yaml=True,
+                 expand=['sources', 'destinations', 'services'])),
+        ('firewall_rule_facts prefetch', 'firewall_rule_facts',
+            dict(filter='policy', as_yaml=True,
+                 expand=['sources', 'destinations', 'services'],
+                 prefetch=['host', 'network', 'tcp_service'])),
+        ('firewall_rule by tag', 'firewall_rule',
+            dict(policy='policy',
+                 rules=[dict(tag='1.1', name='rule-0', comment='benchmark')])),
+        ('firewall_rule by tag indexed', 'firewall_rule',
+            dict(policy='policy',
+                 rules=[dict(tag='%d.1' % (i + 1), name='rule-%d' % i,
+                             comment='benchmark') for i in range(size)])),
+        ('engine_facts', 'engine_facts',
+            dict()),
+        ('engine_facts as_yaml', 'engine_facts',
+            dict(filter='fw-1', as_yaml=True)),
+        ('engine_facts fleet', 'engine_facts',
+            dict(fleet=True)),
+        ('engine_facts fleet filter', 'engine_facts',
+            dict(fleet=True, filter='fw-1', exact_match=True)),
+        ('category_facts filter', 'category_facts',
+            dict(filter='tag')),
+        ('category_facts by_element', 'category_facts',
+            dict(by_element=True)),
+        ('alias_facts filter engine', 'alias_facts',
+            dict(filter='Interface', engine='fw-0')),
+        ('alias_facts filter engines', 'alias_facts',
+            dict(filter='Interface', engines=['fw-%d' % i for i in range(engines)])),
+        ('policy_vpn_facts filter', 'policy_vpn_facts',
+            dict(filter='vpn-0', exact_match=True, smc_max_concurrency=8)),
+        ('policy_vpn_facts expand', 'policy_vpn_facts',
+            dict(filter='vpn-0', exact_match=True,
+                 expand=['vpn_profile', 'fw-0 - Primary', 'fw-1 - Primary'],
+                 smc_max_concurrency=8)),
+        ('routing_facts', 'routing_facts',
+            dict(filter='fw-0')),
+        ('routing_facts longest_match', 'routing_facts',
+            dict(filter='fw-0', longest_match=['172.16.1.10', '8.8.8.8'])),
+        ('routing_facts within', 'routing_facts',
+            dict(filter='fw-0', within=['172.16.0.0/16'], route_type=['Static'],
+                 limit=10)),
+        ('routing_facts snapshot', 'routing_facts',
+            dict(engines=['fw-%d' % i for i in range(engines)],
+                 snapshot_dir=os.path.join(tmp, 'routes'), smc_max_concurrency=8)),
+        ('routing_facts compare_to', 'routing_facts',
+            dict(engines=['fw-%d' % i for i in range(engines)],
+                 compare_to=os.path.join(tmp, 'routes'), smc_max_concurrency=8)),
+        ('policy_push', 'policy_push',
+            dict(engines=['fw-%d' % i for i in range(engines)], sleep=1,
+                 poll_interval=0.05)),
+        ('policy_push only_if_pending', 'policy_push',
+            dict(engines=['fw-%d' % i for i in range(engines)], sleep=1,
+                 poll_interval=0.05, only_if_pending=True)),
+    ]
+
+
+def run_module(module, args):
+    """
+    Run the module main function with args. Returns the module result
+    parsed from the JSON written to stdout.
+    """
+    from ansible.module_utils import basic
+    basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args)).encode('utf-8')
+    mod = __import__(module)
+    stdout = sys.stdout
+    sys.stdout = io.BytesIO() if sys.version_info[0] == 2 else io.StringIO()
+    try:
+        mod.main()
+    except SystemExit:
+        pass
+    finally:
+        output, sys.stdout = sys.stdout.getvalue(), stdout
+    return json.loads(output)
+
+
+def measure(smc, module, args):
+    __import__(module)
+    smc.counters.clear()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    result = run_module(module, args)
+    seconds = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    requests = collections.Counter(dict(
+        (k, v) for k, v in smc.counters.items() if ' ' in k))
+    return dict(
+        seconds=round(seconds, 3),
+        requests=sum(requests.values()),
+        by_method=dict(requests),
+        peak_memory=peak,
+        failed=bool(result.get('failed')),
+        msg=result.get('msg'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=200,
+                        help='number of hosts, networks, services and rules')
+    parser.add_argument('--engines', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to each mock SMC response')
+    parser.add_argument('--padding', type=int, default=0,
+                        help='bytes of filler data added to each element')
+    parser.add_argument('--only', action='append',
+                        help='only run scenarios starting with this label')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    smc = MockSMC(latency=args.latency, padding=args.padding)
+    elements = populate_elements(smc, args.size)
+    populate_policy(smc, 'policy', args.size, elements)
+    populate_engines(smc, args.engines, routes=args.size, policy='policy')
+    smc.start()
+
+    module_args = dict(smc_address=smc.url, smc_api_key='benchmark',
+                       smc_api_version='6.4')
+    results = []
+    tmp = tempfile.mkdtemp()
+    try:
+        for label, module, scenario_args in scenarios(args.size, args.engines, tmp):
+            if args.only and not any(label.startswith(o) for o in args.only):
+                continue
+            scenario_args.update(module_args)
+            try:
+                result = measure(smc, module, scenario_args)
+            except Exception as e:
+                if tracemalloc is not None and tracemalloc.is_tracing():
+                    tracemalloc.stop()
+                result = dict(seconds=0, requests=0, by_method={}, peak_memory=None,
+                              failed=True, msg='%s: %s' % (type(e).__name__, e))
+            result.update(scenario=label, module=module)
+            results.append(result)
+    finally:
+        smc.stop()
+        shutil.rmtree(tmp)
+
+    print('size %d, %d engines, %.3fs latency, %d bytes padding' % (
+        args.size, args.engines, args.latency, args.padding))
+    print('%-32s %8s %9s %11s  %s' % ('', 'seconds', 'requests', 'peak KiB', 'status'))
+    for result in results:
+        peak = result['peak_memory']
+        print('%-32s %8.3f %9d %11s  %s' % (
+            result['scenario'], result['seconds'], result['requests'],
+            '%d' % (peak // 1024) if peak is not None else '-',
+            'failed: %s' % result['msg'] if result['failed'] else 'ok'))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(size=args.size, engines=args.engines,
+                           latency=args.latency, padding=args.padding,
+                           results=results), f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+"""
+Compare the AnsiballZ payload of each module built from library/ and from
+the slim variants written by slim.py. For each module the payload is built
+by ansible the same way as for a task, then run a number of times to
+measure the per-task startup time: the payload is unpacked, the module and
+stonesoft_util are imported and the module exits on an unsupported
+argument, before any connection to the SMC.
+
+Requires ansible and smc-python to be installed::
+
+    python benchmarks/payload.py
+    python benchmarks/payload.py --only engine_facts --runs 20
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, root)
+
+import slim
+
+# Payloads are built in a separate interpreter for each variant, ansible
+# caches the payload of a module by module name for the whole process
+WRAP = '''
+import os, sys, json
+from ansible import constants as C
+from ansible.executor.module_common import modify_module
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+library, dest, modules = sys.argv[1], sys.argv[2], sys.argv[3:]
+templar = Templar(loader=DataLoader())
+sizes = {}
+for module in modules:
+    data, _, _ = modify_module(module, os.path.join(library, module + '.py'),
+                               dict(payload_benchmark=True), templar,
+                               task_vars=dict(ansible_python_interpreter=sys.executable),
+                               module_compression=C.DEFAULT_MODULE_COMPRESSION)
+    with open(os.path.join(dest, module + '.py'), 'wb') as f:
+        f.write(data)
+    sizes[module] = len(data)
+print(json.dumps(sizes))
+'''
+
+
+def wrap(library, module_utils, dest, modules):
+    """
+    Build the AnsiballZ payload of modules into dest.
+
+    :return: dict of module: payload size in bytes
+    """
+    env = dict(os.environ, ANSIBLE_MODULE_UTILS=module_utils,
+               ANSIBLE_LOCAL_TEMP=tempfile.mkdtemp(dir=dest))
+    output = subprocess.check_output(
+        [sys.executable, '-c', WRAP, library, dest] + modules, env=env, cwd=dest)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def run(payload):
+    """
+    Run the payload, returns the time taken in seconds.
+    """
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, payload],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    seconds = time.time() - start
+    if b'payload_benchmark' not in out:
+        raise RuntimeError((err or out).decode('utf-8', 'replace').strip()[-200:])
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='runs of each payload, the fastest is kept')
+    parser.add_argument('--only', action='append',
+                        help='only measure modules starting with this name')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    modules = sorted(name[:-3] for name in os.listdir(os.path.join(root, 'library'))
+                     if name.endswith('.py') and
+                     (not args.only or any(name.startswith(o) for o in args.only)))
+    tmp = tempfile.mkdtemp()
+    try:
+        build = os.path.join(tmp, 'build')
+        for directory in ('library', 'module_utils'):
+            slim.build(os.path.join(root, directory), os.path.join(build, directory))
+
+        variants = (('original', root), ('slim', build))
+        results = dict((module, {}) for module in modules)
+        for variant, path in variants:
+            dest = os.path.join(tmp, variant)
+            os.makedirs(dest)
+            sizes = wrap(os.path.join(path, 'library'), os.path.join(path, 'module_utils'),
+                         dest, modules)
+            for module in modules:
+                results[module][variant] = dict(size=sizes[module], seconds=None)
+
+        # Alternate the variants so both see the same load on the machine
+        for module in modules:
+            try:
+                for _ in range(args.runs):
+                    for variant, _ in variants:
+                        seconds = run(os.path.join(tmp, variant, module + '.py'))
+                        result = results[module][variant]
+                        result['seconds'] = min(result['seconds'] or seconds, seconds)
+            except RuntimeError as e:
+                results[module]['error'] = str(e).splitlines()[-1]
+    finally:
+        shutil.rmtree(tmp)
+
+    print('%-28s %10s %10s %12s %12s' % (
+        '', 'bytes', 'slim bytes', 'startup(s)', 'slim(s)'))
+    for module in modules:
+        result = results[module]
+        original, slimmed = result['original'], result['slim']
+        if 'error' in result:
+            print('%-28s %10d %10d  failed: %s' % (
+                module, original['size'], slimmed['size'], result['error']))
+            continue
+        print('%-28s %10d %10d %12.3f %12.3f' % (
+            module, original['size'], slimmed['size'],
+            original['seconds'], slimmed['seconds']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+"""
+Benchmark the number of SMC logins made by a play with and without the
+session cache (smc_session_cache). Each task runs in a fresh interpreter,
+the same way ansible runs a module, and performs the connect and
+disconnect steps of StonesoftModuleBase against a mock SMC.
+
+Requires ansible and smc-python to be installed::
+
+    python benchmarks/session_reuse.py --tasks 300
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+
+from mock_smc import MockSMC
+
+
+TASK = '''
+import sys, json
+sys.path.insert(0, %(module_utils)r)
+from ansible.module_utils import basic
+basic._ANSIBLE_ARGS = json.dumps(
+    dict(ANSIBLE_MODULE_ARGS=json.loads(sys.argv[1]))).encode('utf-8')
+import stonesoft_util
+
+class Task(stonesoft_util.StonesoftModuleBase):
+    def __init__(self):
+        super(Task, self).__init__({})
+    def exec_module(self, **kwargs):
+        return dict(changed=False)
+
+Task()
+'''
+
+
+def run_play(smc, tasks, session_cache=None):
+    module_args = dict(smc_address=smc.url, smc_api_key='benchmark')
+    if session_cache is not None:
+        module_args.update(smc_session_cache=session_cache)
+
+    script = TASK % dict(
+        module_utils=os.path.join(os.path.dirname(here), 'module_utils'))
+    smc.counters.clear()
+    start = time.time()
+    for _ in range(tasks):
+        subprocess.check_call(
+            [sys.executable, '-c', script, json.dumps(module_args)],
+            stdout=open(os.devnull, 'w'))
+    return dict(
+        logins=smc.counters['logins'],
+        logouts=smc.counters['logouts'],
+        requests=sum(v for k, v in smc.counters.items() if ' ' in k),
+        seconds=round(time.time() - start, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--tasks', type=int, default=50)
+    args = parser.parse_args()
+
+    smc = MockSMC().start()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        before = run_play(smc, args.tasks)
+        after = run_play(smc, args.tasks, dict(path=cache_dir))
+    finally:
+        smc.stop()
+        shutil.rmtree(cache_dir)
+
+    print('%-20s %8s %8s %9s %8s' % ('', 'logins', 'logouts', 'requests', 'seconds'))
+    for label, result in (('login per task', before), ('smc_session_cache', after)):
+        print('%-20s %8d %8d %9d %8.2f' % (
+            label, result['logins'], result['logouts'],
+            result['requests'], result['seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Copyright (c) 2017 David LePage
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: smc_metrics
+    type: aggregate
+    short_description: Summarize SMC requests made by the stonesoft modules
+    version_added: '2.5'
+    description:
+      - Aggregates the I(smc_metrics) returned by stonesoft modules run with
+        C(smc_metrics=true) and displays a summary at the end of the play,
+        including the tasks that made the most requests to the SMC.
+    requirements:
+      - whitelist in configuration, i.e. C(callback_whitelist = smc_metrics)
+    options:
+      top:
+        description: Number of tasks to show, ordered by number of requests
+        default: 10
+        type: int
+        env:
+          - name: SMC_METRICS_TOP
+        ini:
+          - section: callback_smc_metrics
+            key: top
+'''
+
+import collections
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+    """
+    Aggregate smc_metrics from module results across a play
+    """
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'smc_metrics'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.tasks = []
+        self.by_method = collections.Counter()
+        self.by_entry_point = collections.Counter()
+        self.totals = collections.Counter()
+
+    def _record(self, result):
+        metrics = result._result.get('smc_metrics')
+        if not metrics:
+            return
+        self.tasks.append(dict(
+            task=result._task.get_name(),
+            host=result._host.get_name(),
+            requests=metrics.get('requests', 0),
+            latency=metrics.get('latency', {}),
+            login_time=metrics.get('login_time', 0)))
+        self.by_method.update(metrics.get('by_method', {}))
+        self.by_entry_point.update(metrics.get('by_entry_point', {}))
+        self.totals.update(
+            tasks=1,
+            requests=metrics.get('requests', 0),
+            latency=metrics.get('latency', {}).get('total', 0),
+            login_time=metrics.get('login_time', 0),
+            bytes_sent=metrics.get('bytes_sent', 0),
+            bytes_received=metrics.get('bytes_received', 0))
+
+    def v2_runner_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result)
+
+    def v2_playbook_on_stats(self, stats):
+        if not self.tasks:
+            return
+        try:
+            top = int(self.get_option('top'))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            top = 10
+
+        totals = self.totals
+        self._display.banner('SMC METRICS')
+        self._display.display(
+            '%d tasks, %d requests, %.2fs request latency, %.2fs login, '
+            '%d bytes sent, %d bytes received' % (
+                totals['tasks'], totals['requests'], totals['latency'],
+                totals['login_time'], totals['bytes_sent'], totals['bytes_received']))
+        self._display.display('By method: %s' % ', '.join(
+            '%s %d' % (method, count) for method, count in self.by_method.most_common()))
+        self._display.display('By entry point: %s' % ', '.join(
+            '%s %d' % (entry_point, count)
+            for entry_point, count in self.by_entry_point.most_common(top)))
+
+        self._display.display('')
+        self._display.display('%-50s %9s %9s %9s' % ('Task', 'requests', 'total(s)', 'p90(s)'))
+        for task in sorted(self.tasks, key=lambda t: t['requests'], reverse=True)[:top]:
+            self._display.display('%-50s %9d %9.2f %9.3f' % (
+                ('%s (%s)' % (task['task'], task['host']))[:50], task['requests'],
+                task['latency'].get('total', 0), task['latency'].get('p90', 0)))
@@ -53,6 +53,52 @@ options:
           - Full path to the log file
         type: str
         required: true
+  smc_session_cache:
+    description:
+      - Optionally re-use the SMC session across tasks instead of logging in and out
+        for every module run. The session is stored on the host that runs the module,
+        which is the managed host unless the task runs on or is delegated to
+        localhost. It is keyed by a hash of I(smc_address), I(smc_domain) and
+        I(smc_api_key), and is released rather than logged out when the task
+        completes. Only used when I(smc_address) and I(smc_api_key) are provided.
+      - The session file holds a live SMC session cookie that grants the same access
+        as I(smc_api_key) until the session expires. Keep I(path) on a local file
+        system that only the user running the module can read.
+    required: false
+    type: dict
+    suboptions:
+      path:
+        description:
+          - Directory to store session files on the host that runs the module. Session
+            files contain the session cookie only. The directory is created with
+            mode 0700 and the files with mode 0600, an existing directory keeps its
+            permissions.
+        type: str
+        default: ~/.ansible/tmp/stonesoft
+      ttl:
+        description:
+          - Time in seconds a released session can be re-used by a subsequent task.
+            Sessions that have timed out on the SMC are refreshed automatically.
+        type: int
+        default: 600
+  smc_max_concurrency:
+    description:
+      - Max number of element lookups to run in parallel when resolving elements
+        referenced by name, for example users and engines referenced in rules. The
+        default of 1 resolves elements serially.
+    required: false
+    type: int
+    default: 1
+  smc_metrics:
+    description:
+      - Add a I(smc_metrics) key to the module result with the number of requests made
+        to the SMC by method and entry point, the request latency (total, p50, p90, p99
+        and max, in seconds, until the response headers are received), the bytes sent
+        and received and the time taken to log in. Use the smc_metrics callback plugin
+        to aggregate the metrics of all tasks in a play.
+    required: false
+    type: bool
+    default: false
   smc_extra_args:
     description: 
       - Extra arguments to pass to login constructor. These are generally only used if
@@ -54,7 +54,15 @@ def main():
     shutil.copy(os.path.join(here_module_utils, 'stonesoft_util.py'),
                 os.path.join(module_util_path, 'stonesoft_util.py'))
     print("Copying stonesoft_util.py to: %s" % here_module_utils)
-    
+
+    # Save the constructor arguments of the smc-python element classes so
+    # modules do not have to introspect them on each run
+    try:
+        from ansible.module_utils import stonesoft_util
+        print("Writing element types to: %s" % stonesoft_util.write_type_attrs())
+    except Exception as e:
+        print("Skipping element types, modules will introspect smc-python: %s" % e)
+
     
     
     
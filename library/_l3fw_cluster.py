@@ -625,7 +625,7 @@ class StonesoftCluster(StonesoftModuleBase):
             if engine and self.interfaces and not self.skip_interfaces:
                 itf = self.check_interfaces()
             
-            cache = Cache()
+            cache = Cache(max_concurrency=self.smc_max_concurrency)
             
             # SNMP settings
             if self.snmp and self.snmp.get('enabled', True):
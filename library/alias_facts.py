@@ -18,6 +18,9 @@ description:
   - Aliases are dynamic elements that have different values based on the
     engine the alias is applied on. This module allows you to retrieve
     aliases and retrieve their mappings.
+  - When engines are provided, the alias table of each engine is retrieved once
+    and matched locally against the aliases found, for up to I(smc_max_concurrency)
+    engines at a time.
 
 version_added: '2.5'
 
@@ -27,6 +30,14 @@ options:
       - Engine to retrieve for alias mapping
     required: false
     type: str
+  engines:
+    description:
+      - List of engines to resolve the aliases on. Each alias is returned with
+        the values resolved on each engine in I(resolved_values), keyed by
+        engine name. With a filter, the value of an alias not resolved on an
+        engine is an empty list. Mutually exclusive with I(engine).
+    required: false
+    type: list
   
 extends_documentation_fragment:
   - stonesoft
@@ -58,6 +69,14 @@ EXAMPLES = '''
     engine: sg_vm
     exact_match: no
     case_sensitive: no
+
+- name: Resolve interface aliases on several engines
+  alias_facts:
+    filter: Interface ID
+    engines:
+      - sg_vm
+      - myfirewall
+    smc_max_concurrency: 8
 '''
 
 
@@ -82,45 +101,94 @@ aliases:
             "type": "interface_nic_x_net_alias"
         }
     ]
+
+aliases:
+    description: Resolve interface aliases on engines sg_vm and myfirewall
+    returned: when engines are provided
+    type: list
+    sample: [
+        {
+            "name": "$$ Interface ID 0.ip",
+            "resolved_values": {
+                "myfirewall": [
+                    "10.20.0.1"
+                ],
+                "sg_vm": [
+                    "10.10.0.1"
+                ]
+            },
+            "type": "interface_nic_x_ip_alias"
+        }
+    ]
 '''
 
-from ansible.module_utils.stonesoft_util import StonesoftModuleBase
+from ansible.module_utils.stonesoft_util import StonesoftModuleBase, Cache
 
 
 try:
     from smc.elements.network import Alias
-    from smc.core.engine import Engine
-    from smc.api.exceptions import ElementNotFound
 except ImportError:
     pass
 
 
-def alias_dict_from_obj(alias, engine):
+def alias_dict_from_obj(alias):
     """
-    Return dict of alias data. If engine is provided, resolve
-    the values for the dict.
+    Return dict of alias data.
     
     :param Alias alias
-    :param Engine engine
     """
-    elem = {
+    return {
         'name': alias.name,
         'type': alias.typeof,
         'comment': getattr(alias, 'comment', None)}
+
+
+def resolve_aliases(aliases, engines, cache, resolved_only=True):
+    """
+    Resolve aliases on each engine. The alias table of each engine is
+    retrieved once and matched against the aliases by href, instead of
+    resolving each alias separately. Engines are resolved concurrently.
+    
+    :param list aliases: aliases to resolve
+    :param list engines: engines to resolve the aliases on
+    :param Cache cache: cache used to resolve engines concurrently
+    :param bool resolved_only: omit aliases not resolved on any engine,
+        otherwise their resolved value is an empty list
+    :return: list of (alias, dict of engine name: resolved value), in the
+        order of aliases
+    :rtype: list(tuple(Alias, dict))
+    """
+    hrefs = set(alias.href for alias in aliases)
     
-    if engine:
-        elem.update(resolved_value=alias.resolve(engine))
-    return elem
+    def alias_table(engine):
+        return dict((entry.get('alias_ref'), entry.get('resolved_value'))
+            for entry in engine.make_request(resource='alias_resolving')
+            if entry.get('alias_ref') in hrefs)
+    
+    tables = cache._map(alias_table, engines)
+    matrix = []
+    for alias in aliases:
+        if not resolved_only or any(alias.href in table for table in tables):
+            matrix.append((alias, dict(
+                (engine.name, table.get(alias.href, []))
+                for engine, table in zip(engines, tables))))
+    return matrix
     
 
 class AliasFacts(StonesoftModuleBase):
     def __init__(self):
         
         self.module_args = dict(
-            engine=dict(type='str')
+            engine=dict(type='str'),
+            engines=dict(type='list')
         )
-
+        
+        mutually_exclusive = [
+            ['engine', 'engines']
+        ]
+        
         self.engine = None
+        self.engines = None
         self.limit = None
         self.filter = None
         self.exact_match = None
@@ -131,34 +199,47 @@ class AliasFacts(StonesoftModuleBase):
                 aliases=[]
             )
         )
-        super(AliasFacts, self).__init__(self.module_args, is_fact=True)
+        super(AliasFacts, self).__init__(self.module_args, is_fact=True,
+            mutually_exclusive=mutually_exclusive)
 
     def exec_module(self, **kwargs):
         for name, value in kwargs.items():
             setattr(self, name, value)
         
-        # Verify the engine specified
-        if self.engine:
-            try:
-                fw = Engine.get(self.engine)
-            except ElementNotFound:
+        names = self.engines or ([self.engine] if self.engine else [])
+        cache = Cache(max_concurrency=self.smc_max_concurrency)
+        
+        # Verify the engines specified
+        if names:
+            cache.add({'engine': names})
+            if cache.missing:
                 self.fail(
                     msg='Specified engine was not found: {}. Called from: {}'
-                    .format(self.engine, self.__class__.__name__))
+                    .format(', '.join(m['name'] for m in cache.missing),
+                        self.__class__.__name__))
         
-        if self.engine and not self.filter:
-            result = list(fw.alias_resolving())
-            aliases = [{'name': alias.name, 'type': alias.typeof, 'resolved_value': alias.resolved_value}
-                       for alias in result]
-    
-        else:
-                    
-            result = self.search_by_type(Alias)
-            
-            if self.filter:
-                aliases = [alias_dict_from_obj(alias, self.engine) for alias in result]
+        result = self.search_by_type(Alias)
+        
+        if names:
+            engines = [cache.get('engine', name) for name in names]
+            matrix = resolve_aliases(result, engines, cache,
+                resolved_only=not self.filter)
+            if self.engines:
+                aliases = [{'name': alias.name, 'type': alias.typeof, 'resolved_values': values}
+                           for alias, values in matrix]
+            elif self.filter:
+                # Same output as without an engine, with the resolved value
+                aliases = cache._map(alias_dict_from_obj, result)
+                for alias, (_, values) in zip(aliases, matrix):
+                    alias.update(resolved_value=values[self.engine])
             else:
-                aliases = [{'name': alias.name, 'type': alias.typeof} for alias in result]
+                aliases = [{'name': alias.name, 'type': alias.typeof,
+                            'resolved_value': values[self.engine]}
+                           for alias, values in matrix]
+        elif self.filter:
+            aliases = [alias_dict_from_obj(alias) for alias in result]
+        else:
+            aliases = [{'name': alias.name, 'type': alias.typeof} for alias in result]
         
         self.results['ansible_facts'] = {'aliases': aliases}
         return self.results
@@ -167,4 +248,4 @@ def main():
     AliasFacts()
     
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -17,8 +17,20 @@ short_description: Facts about category tag elements in the SMC
 description:
   - Category tags can be added to most elements in the SMC to identify elements
     and for grouping purposes.
+  - References of the categories matching I(filter) are resolved with one search
+    per category tag, run by up to I(smc_max_concurrency) workers. Referenced
+    elements are returned from the search results and are not loaded.
 
 version_added: '2.5'
+
+options:
+  by_element:
+    description:
+      - Return the elements tagged by the categories matching I(filter), or by all
+        categories if no filter is provided, each with the names of its categories.
+        Facts are returned in I(elements) instead of I(categories).
+    type: bool
+    default: false
   
 extends_documentation_fragment:
   - stonesoft
@@ -46,6 +58,11 @@ EXAMPLES = '''
       filter: smc-python
       exact_match: yes
       case_sensitive: yes
+
+- name: Return all tagged elements and their categories
+    category_facts:
+      by_element: yes
+      smc_max_concurrency: 8
 '''
 
 
@@ -75,9 +92,22 @@ categories:
             }], 
             "type": "category_tag"
     }]
+
+elements:
+    description: Elements tagged by the categories when using I(by_element)
+    returned: when by_element is true
+    type: list
+    sample: [{
+        "categories": [
+            "aws",
+            "smc-python"
+        ],
+        "name": "172.18.1.135",
+        "type": "host"
+    }]
 '''
 
-from ansible.module_utils.stonesoft_util import StonesoftModuleBase
+from ansible.module_utils.stonesoft_util import StonesoftModuleBase, CategoryIndex
 
 
 try:
@@ -86,30 +116,52 @@ except ImportError:
     pass
 
 
-def category_dict_from_obj(element):
+def category_dict_from_obj(element, index):
     """
     Resolve the category to the supported types and return a dict
     with the values of defined attributes
     
     :param Element element
+    :param CategoryIndex index: index built with this category
     """
-    elem = {
+    return {
         'name': element.name,
         'type': element.typeof,
-        'references': [],
+        'references': [{'name': reference.name, 'type': reference.typeof}
+            for reference in index.elements(element)],
+        # Category was loaded to search its elements
         'comment': getattr(element, 'comment', None)}
+
+
+def elements_from_index(index):
+    """
+    Elements referenced by the indexed categories, with the names of
+    the categories assigned to each element.
     
-    for reference in element.search_elements():
-        elem['references'].append(
-            {'name': reference.name, 'type': reference.typeof})
-    
-    return elem
+    :param CategoryIndex index: category index
+    :rtype: list(dict)
+    """
+    elements = {}
+    for references in index.members.values():
+        for reference in references:
+            if reference.href not in elements:
+                elements[reference.href] = {
+                    'name': reference.name,
+                    'type': reference.typeof,
+                    'categories': sorted(
+                        tag.name for tag in index.categories(reference))}
+    return sorted(elements.values(), key=lambda e: (e['type'], e['name']))
 
 
 class CategoryFacts(StonesoftModuleBase):
     def __init__(self):
         
+        self.module_args = dict(
+            by_element=dict(default=False, type='bool')
+        )
+        
         self.element = 'category'
+        self.by_element = None
         self.limit = None
         self.filter = None
         self.exact_match = None
@@ -120,16 +172,22 @@ class CategoryFacts(StonesoftModuleBase):
                 categories=[]
             )
         )
-        super(CategoryFacts, self).__init__({}, is_fact=True)
+        super(CategoryFacts, self).__init__(self.module_args, is_fact=True)
 
     def exec_module(self, **kwargs):
         for name, value in kwargs.items():
             setattr(self, name, value)
         
         result = self.search_by_type(Category)
+        if self.by_element:
+            index = CategoryIndex(max_concurrency=self.smc_max_concurrency).build(result)
+            self.results['ansible_facts'] = {'elements': elements_from_index(index)}
+            return self.results
+        
         # Search by specific element type
-        if self.filter:    
-            elements = [category_dict_from_obj(element) for element in result]
+        if self.filter:
+            index = CategoryIndex(max_concurrency=self.smc_max_concurrency).build(result)
+            elements = [category_dict_from_obj(element, index) for element in result]
         else:
             elements = [{'name': element.name, 'type': element.typeof} for element in result]
         
@@ -565,7 +565,7 @@ class StonesoftEngine(StonesoftModuleBase):
                 else:
                     itf = []
 
-            cache = Cache()
+            cache = Cache(max_concurrency=self.smc_max_concurrency)
             
             # SNMP settings
             if self.snmp and self.snmp.get('enabled', True):
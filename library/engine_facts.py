@@ -34,6 +34,27 @@ options:
       - ips_clusters
       - fw_clusters
     type: str
+  fleet:
+    description:
+      - Return all engines matching the search in editable YAML format. A
+        filter is optional and does not need to match a single engine. Zones,
+        netlinks, BGP peers, categories, log servers and policy VPNs are fetched
+        once and shared between engines rather than being fetched for each
+        engine. Only single and cluster firewall engines are expanded, other
+        engine types are returned with name and type only.
+      - Engines are serialized by up to I(smc_max_concurrency) workers and are
+        returned in the order of the search results. The time taken for each
+        engine is logged to the I(smc_logging) log, engines taking longer than
+        I(slow_engine) seconds are logged as a warning and returned as module
+        warnings.
+    type: bool
+    default: false
+  slow_engine:
+    description:
+      - Seconds after which serializing a single engine is reported as slow
+        when using I(fleet)
+    type: int
+    default: 10
   
 extends_documentation_fragment:
   - stonesoft
@@ -82,6 +103,13 @@ EXAMPLES = '''
 
   - name: Write the yaml using a jinja template
     template: src=templates/engine_yaml.j2 dest=./l3fw_cluster.yml
+
+  - name: Export all firewall engines in editable YAML format
+    register: results
+    engine_facts:
+      element: fw_clusters
+      fleet: true
+      smc_max_concurrency: 8
 '''
 
 
@@ -134,16 +162,21 @@ engines:
         ...
     }]
 '''
-from ansible.module_utils.stonesoft_util import StonesoftModuleBase
+import time
+import logging
+import threading
+from ansible.module_utils.stonesoft_util import StonesoftModuleBase, Cache, \
+    CategoryIndex
 
 
 ENGINE_TYPES = frozenset(['fw_clusters', 'engine_clusters', 'ips_clusters',
                           'layer2_clusters'])
 
 
+logger = logging.getLogger('smc.ansible.engine_facts')
+
+
 try:
-    from smc.elements.network import Zone
-    from smc.vpn.policy import PolicyVPN
     from smc.core.sub_interfaces import ClusterVirtualInterface
     from smc.core.interfaces import Layer3PhysicalInterface, TunnelInterface, \
         ClusterPhysicalInterface
@@ -151,13 +184,127 @@ except ImportError:
     pass
 
 
-def zone_finder(zones, zone):
-    for z in zones:
-        if z.href == zone:
-            return z.name
+class EngineCache(Cache):
+    """
+    Cache shared between engines when serializing many engines. Elements
+    referenced by engines are listed once per type, category tags are
+    resolved once per category when there are more engines than categories
+    and policy VPN gateway node listings once per VPN, instead of once per
+    engine.
+    """
+    prefetch_types = ('interface_zone', 'netlink', 'bgp_peering',
+        'external_bgp_peer', 'log_server', 'location', 'snmp_agent', 'vpn')
+    
+    def __init__(self, **kwargs):
+        super(EngineCache, self).__init__(**kwargs)
+        self.index = None # CategoryIndex
+        self.vpns = {} # (vpn href, node type): set(gateway names)
+        self._vpn_lock = threading.Lock()
+        self._vpn_locks = {} # (vpn href, node type): Lock
+    
+    def prefetch(self, engines=0):
+        """
+        List all element types referenced by engines. The map of category
+        tags by element href is only built when there are more engines
+        than category tags, as it takes one search per category tag.
+        Otherwise the categories are fetched for each engine.
+        
+        :param int engines: number of engines to serialize
+        """
+        self._map(self.add_type, self.prefetch_types + ('category_tag',))
+        categories = self.get_type('category_tag')
+        if engines > len(categories):
+            self.index = CategoryIndex(
+                max_concurrency=self.max_concurrency).build(categories)
+    
+    def serialize(self, engines, slow=None):
+        """
+        Serialize engines with up to `max_concurrency` workers. Results
+        are returned in the order of engines. Engine types that are not
+        supported by :func:`to_yaml` only return the name and type.
+        
+        :param list engines: engines to serialize
+        :param int slow: seconds after which an engine is logged as slow
+        :return: list of tuple (engine dict, seconds taken)
+        :rtype: list(tuple)
+        """
+        def serialize(engine):
+            start = time.time()
+            if 'single_fw' in engine.type or 'cluster' in engine.type:
+                result = to_yaml(engine, self)
+            else:
+                result = {'name': engine.name, 'type': engine.type}
+            duration = time.time() - start
+            if slow is not None and duration >= slow:
+                logger.warning('Engine %s took %.2f seconds to serialize',
+                    engine.name, duration)
+            else:
+                logger.debug('Engine %s took %.2f seconds to serialize',
+                    engine.name, duration)
+            return result, duration
+        return self._map(serialize, engines)
+    
+    def name(self, href):
+        """
+        Name of the element referenced by href
+        
+        :rtype: str or None
+        """
+        if href:
+            element = self.get_href(href)
+            if element is not None:
+                return element.name
+    
+    def categories(self, engine):
+        """
+        Names of the category tags assigned to the engine
+        
+        :rtype: list(str)
+        """
+        if self.index is None:
+            return sorted(tag.name for tag in engine.categories)
+        return sorted(tag.name for tag in self.index.categories(engine))
+    
+    def vpn_nodes(self, href, node_type):
+        """
+        Names of the gateways in a gateway node listing of the policy VPN.
+        The names are read from the raw listing, the name of a GatewayNode
+        element would load the node.
+        
+        :param str href: href of the policy VPN
+        :param str node_type: central_gateway_node, satellite_gateway_node
+            or mobile_gateway_node
+        :rtype: set(str)
+        """
+        key = (href, node_type)
+        with self._vpn_lock:
+            lock = self._vpn_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.vpns:
+                # Gateway nodes are listed without opening the policy VPN
+                # for edit, which would lock it on the SMC
+                nodes = self.get_href(href).make_request(resource=node_type)
+                self.vpns[key] = set(node.get('name') for node in nodes)
+        return self.vpns[key]
+    
+    
+def zone_finder(cache, zone):
+    return cache.name(zone)
+
+
+def routing_element(cache, node):
+    """
+    Element referenced by a routing node. The cached element is returned
+    if available so that older SMC versions that do not provide the
+    element type in the routing node do not fetch the element.
+    """
+    element = cache.get_by_href(node.data.get('href'))
+    if element is not None:
+        return element
+    return node.routing_node_element
 
 
-def yaml_cluster(engine):
+def yaml_cluster(engine, cache):
     """
     Example interface dict created from cluster engine:
         
@@ -177,9 +324,10 @@ def yaml_cluster(engine):
     Nodes dict key will always have at least `address`,
     `network_value` and `nodeid` if the interface definition
     has interface addresses assigned.
+    
+    Referenced elements are resolved through the cache, see
+    :class:`EngineCache`.
     """
-    # Prefetch all zones to reduce queries
-    zone_cache = list(Zone.objects.all())
     management = ('primary_mgt', 'backup_mgt', 'primary_heartbeat')
     yaml_engine = {'name': engine.name, 'type': engine.type}
     interfaces = []
@@ -199,7 +347,7 @@ def yaml_cluster(engine):
             top_itf.update(comment=interface.comment)
         if interface.zone_ref:
             top_itf.update(zone_ref=zone_finder(
-                zone_cache, interface.zone_ref))
+                cache, interface.zone_ref))
         
         cvi_mode = getattr(interface, 'cvi_mode', None)
         if cvi_mode is not None and cvi_mode != 'none':
@@ -278,7 +426,7 @@ def yaml_cluster(engine):
             
                         if vlan.zone_ref:
                             itf.update(zone_ref=zone_finder(
-                                zone_cache, vlan.zone_ref))
+                                cache, vlan.zone_ref))
                         
                         nodes.setdefault('nodes', []).append(node)
                         
@@ -293,7 +441,7 @@ def yaml_cluster(engine):
                     # Empty VLAN, check for zone
                     if vlan.zone_ref:
                         itf.update(zone_ref=zone_finder(
-                            zone_cache, vlan.zone_ref))
+                            cache, vlan.zone_ref))
                     
                     top_itf.setdefault('interfaces', []).append(itf)    
                     
@@ -310,13 +458,18 @@ def yaml_cluster(engine):
         yaml_engine.update(comment=engine.comment)
 
     # Only return the location if it is not the default (Not set) location
-    location = engine.location
-    if location:
-        yaml_engine.update(location=location.name)
+    location = cache.name(getattr(engine, 'location_ref', None))
+    if location and location != 'Default':
+        yaml_engine.update(location=location)
+    
+    log_server = cache.name(getattr(engine, 'log_server_ref', None))
+    if log_server:
+        yaml_engine.update(log_server=log_server)
+    
     # Show SNMP data if SNMP is enabled
     if engine.snmp.status:
         snmp = engine.snmp
-        data = dict(snmp_agent=snmp.agent.name)
+        data = dict(snmp_agent=cache.name(engine.snmp_agent_ref))
         if snmp.location:
             data.update(snmp_location=snmp.location)
         interfaces = snmp.interface
@@ -361,14 +514,15 @@ def yaml_cluster(engine):
         
     yaml_engine.update(bgp=data)
     bgp_peering = []
-    for interface, network, peering in engine.routing.bgp_peerings:
+    routing = engine.routing
+    for interface, network, peering in routing.bgp_peerings:
         peer_data = {}
         peer_data.update(interface_id=interface.nicid,
                          name=peering.name)
         if network:
             peer_data.update(network=network.ip)
         for gateway in peering:
-            if gateway.routing_node_element.typeof == 'external_bgp_peer':
+            if routing_element(cache, gateway).typeof == 'external_bgp_peer':
                 peer_data.update(external_bgp_peer=gateway.name)
             else:
                 peer_data.update(engine=gateway.name)
@@ -378,13 +532,13 @@ def yaml_cluster(engine):
     
     # Netlinks
     netlinks = []
-    for netlink in engine.routing.netlinks:
+    for netlink in routing.netlinks:
         interface, network, link = netlink
         netlink = {'interface_id': interface.nicid,
                    'name': link.name}
             
         for gw in link:
-            gateway = gw.routing_node_element
+            gateway = routing_element(cache, gw)
             netlink.setdefault('destination', []).append(
                 {'name': gateway.name, 'type': gateway.typeof})
         
@@ -393,51 +547,61 @@ def yaml_cluster(engine):
         yaml_engine.update(netlinks=netlinks)
     
     # Policy VPN
-    policy_vpn = get_policy_vpn(engine)
+    policy_vpn = get_policy_vpn(engine, cache)
     if policy_vpn:
         yaml_engine.update(policy_vpn=policy_vpn)
      
     # Lastly, get tags
-    tags = [tag.name for tag in engine.categories]
+    tags = cache.categories(engine)
     if tags:
         yaml_engine.update(tags=tags)
     return yaml_engine
 
 
-def get_policy_vpn(engine):
-    vpn_mappings = engine.vpn_mappings
-    engine_internal_gw = engine.vpn.internal_gateway.name
+def get_policy_vpn(engine, cache):
+    """
+    Policy VPNs the engine is mapped to and the role of the engine's
+    internal gateway in each VPN. The role is read from the gateway node
+    usage of the VPN mapping. SMC versions that do not return the node
+    usage fall back to matching the internal gateway name against the
+    gateway node listings of the VPN.
+    """
     policy_vpn = []
     _seen = []
-    if vpn_mappings:
-        for mapping in vpn_mappings:
-            mapped_vpn = mapping.vpn
-            if mapped_vpn.name not in _seen:
-                _vpn = {'name': mapped_vpn.name}
-                vpn = PolicyVPN(mapped_vpn.name)
-                vpn.open()
-                nodes = vpn.central_gateway_node
-                node_central = nodes.get_contains(engine_internal_gw)
-                _vpn.update(central_node=True if node_central else False)
-                if not node_central: # If it's a central node it can't be a satellite node
-                    nodes = vpn.satellite_gateway_node
-                    _vpn.update(satellite_node=True if nodes.get_contains(engine_internal_gw) else False)
-                else:
-                    _vpn.update(satellite_node=False)
-                if vpn.mobile_vpn_topology != 'None':
-                    mobile_node = vpn.mobile_gateway_node
-                    _vpn.update(mobile_gateway=True if mobile_node.get_contains(engine_internal_gw) else False)
-                
-                policy_vpn.append(_vpn)
-                vpn.close()
-                _seen.append(mapped_vpn.name)
+    for mapping in engine.vpn_mappings:
+        if mapping.vpn_ref not in _seen:
+            vpn = cache.get_href(mapping.vpn_ref)
+            _vpn = {'name': vpn.name}
+            mobile = vpn.mobile_vpn_topology != 'None'
+            if mapping.gateway_nodes_usage:
+                node_central = mapping.is_central_gateway
+                _vpn.update(central_node=node_central)
+                _vpn.update(satellite_node=not node_central and mapping.is_satellite_gateway)
+                if mobile:
+                    _vpn.update(mobile_gateway=mapping.is_mobile_gateway)
+            else:
+                gateway = cache.name(mapping.gateway_ref)
+                in_nodes = lambda node_type: gateway in cache.vpn_nodes(
+                    mapping.vpn_ref, node_type)
+                node_central = in_nodes('central_gateway_node')
+                _vpn.update(central_node=node_central)
+                # If it's a central node it can't be a satellite node
+                _vpn.update(satellite_node=not node_central and in_nodes('satellite_gateway_node'))
+                if mobile:
+                    _vpn.update(mobile_gateway=in_nodes('mobile_gateway_node'))
+            
+            policy_vpn.append(_vpn)
+            _seen.append(mapping.vpn_ref)
     return policy_vpn
 
     
-def to_yaml(engine):
+def to_yaml(engine, cache=None):
     if 'single_fw' in engine.type or 'cluster' in engine.type:
+        if cache is None:
+            cache = EngineCache()
+            cache.add_type('interface_zone')
         #return yaml_firewall(engine)
-        return yaml_cluster(engine)
+        return yaml_cluster(engine, cache)
     else:
         raise ValueError('Only single FW and cluster FW types are '
             'currently supported.')
@@ -447,7 +611,9 @@ class EngineFacts(StonesoftModuleBase):
     def __init__(self):
         
         self.module_args = dict(
-            element=dict(default='engine_clusters', type='str', choices=list(ENGINE_TYPES))
+            element=dict(default='engine_clusters', type='str', choices=list(ENGINE_TYPES)),
+            fleet=dict(default=False, type='bool'),
+            slow_engine=dict(default=10, type='int')
         )
     
         self.element = None
@@ -456,6 +622,8 @@ class EngineFacts(StonesoftModuleBase):
         self.as_yaml = None
         self.exact_match = None
         self.case_sensitive = None
+        self.fleet = None
+        self.slow_engine = None
         
         required_if=([
             ('as_yaml', True, ['filter'])])
@@ -474,7 +642,9 @@ class EngineFacts(StonesoftModuleBase):
         
         result = self.search_by_context()
         engines = []
-        if self.filter:
+        if self.fleet:
+            engines = self.fleet_export(result)
+        elif self.filter:
             if self.as_yaml:
                 engines = [to_yaml(engine) for engine in result
                            if engine.name == self.filter]
@@ -485,6 +655,24 @@ class EngineFacts(StonesoftModuleBase):
         
         self.results['ansible_facts']['engines'] = engines
         return self.results
+    
+    def fleet_export(self, engines):
+        """
+        Serialize all engines using a cache shared between engines.
+        
+        :param list engines: engines from search
+        :rtype: list(dict)
+        """
+        cache = EngineCache(max_concurrency=self.smc_max_concurrency)
+        cache.prefetch(len(engines))
+        result = []
+        for engine, (data, duration) in zip(
+            engines, cache.serialize(engines, self.slow_engine)):
+            if duration >= self.slow_engine:
+                self.module.warn('Engine %s took %.2f seconds to serialize' % (
+                    engine.name, duration))
+            result.append(data)
+        return result
 
 def main():
     EngineFacts()
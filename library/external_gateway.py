@@ -220,7 +220,7 @@ class ExternalVPNGW(StonesoftModuleBase):
                 if not site_name:
                     self.fail(msg='VPN site requires a name attribute')
             
-                cache = Cache()
+                cache = Cache(max_concurrency=self.smc_max_concurrency)
                 cache.add(self.vpn_site)
                 if cache.missing:
                     self.fail(msg='Could not find the specified elements for the '
@@ -340,6 +340,14 @@ options:
           - Provide a rule tag ID for which to add the rule before. This is only relevant for
             rules that are being created.
         type: str
+  skip_unchanged:
+    description:
+      - Compare rules that specify a I(tag) with the current rule before resolving
+        any referenced elements. A rule is skipped when the fields provided match the
+        current rule as returned by the firewall_rule_facts module. Rules using
+        I(add_before) or I(add_after) are always processed.
+    type: bool
+    default: false
   state:
     description:
       - Create or delete a firewall cluster
@@ -348,6 +356,14 @@ options:
     choices:
       - present
       - absent
+
+notes:
+  - New rules are created with one request per rule. The SMC API does not provide
+    a batch create for rules and each create is positioned relative to the rules
+    before it (I(add_before), I(add_after) or the top of the policy), so creates are
+    sent in order over the same session. When re-running large rule sets, export
+    the rules with tags and use I(skip_unchanged) so existing rules are not
+    processed again.
     
 '''
 
@@ -488,18 +504,19 @@ EXAMPLES = '''
     -   tag: '2097203.0'
     state: absent
 '''
+import json
+import hashlib
 import traceback
 from ansible.module_utils.six import integer_types
 from ansible.module_utils.six import string_types
 
-from ansible.module_utils.stonesoft_util import (
-    StonesoftModuleBase, Cache)
+from ansible.module_utils.stonesoft_util import StonesoftModuleBase, Cache
 
 
 try:
     from smc.policy.layer3 import FirewallPolicy
     from smc.policy.layer3 import FirewallSubPolicy
-    from smc.api.exceptions import SMCException
+    from smc.api.exceptions import SMCException, CreateRuleFailed
     from smc.policy.rule_elements import LogOptions, ConnectionTracking, \
         Action, AuthenticationOptions
 except ImportError:
@@ -524,6 +541,17 @@ service_targets = ('service_group', 'tcp_service_group', 'udp_service_group', 'i
     'icmp_service_group', 'tcp_service', 'udp_service', 'ip_service', 'ethernet_service', 'icmp_service',
     'application_situation', 'url_category')
 
+rule_fields = ('sources', 'destinations', 'services')
+
+option_fields = ('inspection_options', 'log_options', 'connection_tracking',
+    'authentication_options')
+
+fingerprint_fields = ('tag', 'name', 'comment', 'is_disabled', 'action',
+    'vpn_policy', 'mobile_vpn', 'sub_policy') + rule_fields + option_fields
+
+engine_type = ('single_fw', 'single_layer2', 'single_ips', 'virtual_fw',
+    'fw_cluster', 'master_engine')
+
 sentinel = object()
 
 
@@ -711,6 +739,142 @@ def compare_rules(rule, rule_dict):
     return changes
 
 
+def normalize(value):
+    """
+    Normalize a yaml value for comparison. Lists are sorted as the
+    order of sources, destinations, services and users is not relevant.
+    """
+    if isinstance(value, dict):
+        return dict((k, normalize(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return sorted((normalize(v) for v in value), key=repr)
+    return value
+
+
+def rule_fingerprint(rule_dict):
+    """
+    Hash of the normalized rule representation.
+    
+    :param dict rule_dict: rule in yaml format
+    :rtype: str
+    """
+    return hashlib.sha1(json.dumps(
+        normalize(rule_dict), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def current_value(rule, field, expand=False, cache=None):
+    """
+    Value of a rule field in the format returned by firewall_rule_facts
+    with as_yaml. Only the requested field is read from the rule.
+    Sources, destinations and services are returned as hrefs, or as
+    names keyed by element type if expand is set.
+    
+    :param Rule rule: rule fetched from policy
+    :param str field: field name from fingerprint_fields
+    :param bool expand: return element names instead of hrefs
+    :param Cache cache: optional cache to resolve referenced elements
+    """
+    if field in ('name', 'tag', 'comment', 'is_disabled'):
+        return getattr(rule, field)
+    if rule.is_rule_section:
+        return None
+    
+    if field in rule_fields:
+        elements = getattr(rule, field)
+        if elements.is_any:
+            return {'any': True}
+        if elements.is_none:
+            return {'none': True}
+        if not expand:
+            return elements.all_as_href()
+        if cache is not None:
+            entries = [cache.get_href(href) for href in elements.all_as_href()]
+        else:
+            entries = elements.all()
+        names = {}
+        for entry in entries:
+            if entry is None:
+                continue
+            element_type = entry.typeof
+            if entry.typeof in engine_type:
+                element_type = 'engine'
+            elif 'alias' in entry.typeof:
+                element_type = 'alias'
+            names.setdefault(element_type, []).append(entry.name)
+        return names
+    
+    action = rule.action
+    if field == 'action':
+        return action.action
+    if field == 'log_options':
+        return rule.data.get('options')
+    if field == 'connection_tracking':
+        return action.connection_tracking_options.data
+    if field == 'inspection_options':
+        return {
+            'decrypting': action.decrypting,
+            'deep_inspection': action.deep_inspection,
+            'file_filtering': action.file_filtering}
+    if field == 'authentication_options':
+        auth_options = {
+            'require_auth': rule.authentication_options.require_auth,
+            'methods': [m.name for m in rule.authentication_options.methods]}
+        for user in rule.authentication_options.users:
+            if 'user_group' in user.typeof:
+                auth_options.setdefault('groups', []).append(user.unique_id)
+            else:
+                auth_options.setdefault('users', []).append(user.unique_id)
+        return auth_options
+    if field == 'sub_policy':
+        if action.action == 'jump':
+            return action.sub_policy.name
+    elif action.action in ('enforce_vpn', 'forward_vpn', 'apply_vpn'):
+        if field == 'vpn_policy' and action.vpn:
+            return action.vpn.name
+        if field == 'mobile_vpn' and not action.vpn:
+            return action.mobile_vpn
+
+
+def is_rule_unchanged(rule, current, cache=None):
+    """
+    Compare a rule from yaml with the current rule without resolving
+    any referenced elements. Only fields provided in the yaml are
+    compared, using the same defaults the module uses when creating
+    the rule dict. Sources, destinations and services are compared
+    as hrefs, or by name if provided as a dict of element types.
+    
+    :param dict rule: firewall rule defined in yaml
+    :param Rule current: rule fetched from policy
+    :param Cache cache: optional cache to resolve referenced elements
+    :rtype: bool
+    """
+    if any(key not in fingerprint_fields for key in rule):
+        return False
+    
+    expand = [field for field in rule_fields
+              if isinstance(rule.get(field), dict) and
+              'any' not in rule[field] and 'none' not in rule[field]]
+    
+    defaults = dict(name=None, is_disabled=False)
+    if not current.is_rule_section: # Rule sections only have name and comment
+        defaults.update(action='allow')
+        defaults.update((field, {'any': True}) for field in rule_fields)
+    
+    expected = dict(defaults)
+    expected.update((key, value) for key, value in rule.items() if key != 'tag')
+    
+    actual = {}
+    for key, value in expected.items():
+        _current = current_value(current, key, key in expand, cache)
+        if key in option_fields and isinstance(value, dict):
+            _current = _current or {}
+            actual[key] = dict((k, _current.get(k)) for k in value)
+        else:
+            actual[key] = _current
+    
+    return rule_fingerprint(expected) == rule_fingerprint(actual)
+
+
 def get_tag(tag):
     """
     Get the rule tag. Used by the search function that needs
@@ -725,6 +889,54 @@ def get_tag(tag):
             return tag
         except ValueError:
             pass
+
+
+def rule_key(rule):
+    """
+    Get the rule key, the rule tag without the revision number. The
+    tag is read from the rule data, the rule is fetched if it has not
+    been loaded yet.
+    
+    :return: string representation of rule key
+    :rtype: str
+    """
+    return get_tag(rule.tag)
+
+
+def href_key(href):
+    """
+    Get the expected rule key from the rule href. The SMC uses the rule
+    id as the tag of a rule, so listed, created and moved rules can be
+    indexed without fetching them. Lookups still verify the rule tag.
+    
+    :param str href: href of the rule
+    :rtype: str
+    """
+    return href.rstrip('/').rsplit('/', 1)[-1]
+
+
+def move_rule(rule, other_rule, position):
+    """
+    Move a rule after or before another rule. Like the smc-python
+    move_rule_after and move_rule_before, a copy of the rule is created
+    at the new position and the original is deleted, but the copy is
+    returned so it can be used without searching for it.
+    
+    :param Rule rule: rule to move
+    :param Rule other_rule: rule to position the rule relative to
+    :param str position: add_after or add_before
+    :raises CreateRuleFailed: failed to copy the rule, no move is made
+    :return: the moved rule
+    :rtype: Rule
+    """
+    result = rule.make_request(
+        CreateRuleFailed,
+        href=other_rule.get_relation(position),
+        method='create',
+        json=rule,
+        raw_result=True)
+    rule.delete()
+    return type(rule)(name=rule.name, href=result.href, type=rule.typeof)
         
 
 class FirewallRule(StonesoftModuleBase):
@@ -736,6 +948,7 @@ class FirewallRule(StonesoftModuleBase):
             template=dict(type='str'),
             rules=dict(type='list', default=[]),
             inspection_policy=dict(type='str'),
+            skip_unchanged=dict(default=False, type='bool'),
             state=dict(default='present', type='str', choices=['present', 'absent'])
         )
         
@@ -745,6 +958,9 @@ class FirewallRule(StonesoftModuleBase):
         self.rules = None
         self.inspection_policy = None
         self.use_search_hints = None
+        self.skip_unchanged = None
+        self.rule_index = None
+        self.rule_listing = None
         
         mutually_exclusive = [
             ['policy', 'sub_policy'],
@@ -784,8 +1000,11 @@ class FirewallRule(StonesoftModuleBase):
                         validate_rule(rule)
                     except Exception as e:
                         self.fail(msg=str(e))
+                
+                if self.skip_unchanged:
+                    self.rules = self.changed_rules(policy)
         
-                self.cache = Cache()
+                self.cache = Cache(max_concurrency=self.smc_max_concurrency)
 
                 for rule in self.rules:
                     # Resolve elements if they exist, calls to SMC could happen here
@@ -891,6 +1110,8 @@ class FirewallRule(StonesoftModuleBase):
                             after=rule.get('add_after'))
                         
                         rule = policy.fw_ipv4_access_rules.create(**rule_dict)
+                        if self.rule_listing is not None:
+                            self.rule_listing[href_key(rule.href)] = rule
                         changed = True
                         self.results['state'].append({
                             'rule': rule.name,
@@ -905,17 +1126,17 @@ class FirewallRule(StonesoftModuleBase):
                             continue
 
                         changes = compare_rules(target_rule, rule_dict)
-                        # Changes have already been merged if any
-                        if rule.get('add_after', None):
-                            rule_at_pos = self.rule_by_tag(policy, rule.get('add_after'))
-                            if rule_at_pos:
-                                target_rule.move_rule_after(rule_at_pos)
-                                changes.append('add_after')
-                        elif rule.get('add_before', None):
-                            rule_at_pos = self.rule_by_tag(policy, rule.get('add_before'))
+                        # Changes have already been merged if any. A move creates
+                        # a copy of the rule with a new tag and deletes the original
+                        position = 'add_after' if rule.get('add_after', None) else \
+                            'add_before' if rule.get('add_before', None) else None
+                        if position:
+                            rule_at_pos = self.rule_by_tag(policy, rule.get(position))
                             if rule_at_pos:
-                                target_rule.move_rule_before(rule_at_pos)
-                                changes.append('add_before')
+                                moved = move_rule(target_rule, rule_at_pos, position)
+                                self.forget_rule(rule.get('tag'))
+                                self.rule_listing[href_key(moved.href)] = moved
+                                changes.append(position)
                         elif changes:
                             target_rule.save()
                         
@@ -933,6 +1154,7 @@ class FirewallRule(StonesoftModuleBase):
                         target_rule = self.rule_by_tag(policy, rule.get('tag'))
                         if target_rule:
                             target_rule.delete()
+                            self.forget_rule(rule.get('tag'))
                             changed = True
                             self.results['state'].append({
                                 'rule': target_rule.name,
@@ -951,14 +1173,83 @@ class FirewallRule(StonesoftModuleBase):
         '1234566.0'. When doing a search_rule, you must omit the part
         after the dot(.) to find the rule.
         
+        Rules found are kept in an index by tag. Tags not yet in the index
+        are looked up in the policy rule listing, see :meth:`index_rules`,
+        and the tag of the listed rule is verified. Otherwise they fall
+        back to a rule search, for example for rules added to the policy
+        outside of this task.
+        
         :param FirewallPolicy policy: policy reference
         :param str tag: tag
         :rtype: Rule or None
         """
+        if self.rule_index is None:
+            self.rule_index = {}
+            self.rule_listing = self.index_rules(policy)
+        
         resolved_tag = get_tag(tag)
+        if resolved_tag in self.rule_index:
+            return self.rule_index[resolved_tag]
+        
+        rule = self.rule_listing.pop(resolved_tag, None)
+        if rule is not None:
+            key = rule_key(rule)
+            self.rule_index[key] = rule
+            if key == resolved_tag:
+                return rule
+        
         rule = policy.search_rule('@{}'.format(resolved_tag))
         if rule:
+            self.rule_index[resolved_tag] = rule[0]
             return rule[0]
+    
+    def forget_rule(self, tag):
+        """
+        Remove a moved or deleted rule from the index.
+        
+        :param str tag: tag of the rule
+        """
+        self.rule_index.pop(get_tag(tag), None)
+        self.rule_listing.pop(get_tag(tag), None)
+        
+    def index_rules(self, policy):
+        """
+        Index the policy rule listing by the rule id in the rule href. The
+        listing only provides the rule metadata, the tag is verified when
+        a rule is looked up, which loads the rule. The listing is a single
+        request that replaces a search per tag, so the policy is only
+        listed when the task references more than one tag.
+        
+        :param FirewallPolicy policy: policy reference
+        :return: dict of expected rule key: rule
+        :rtype: dict
+        """
+        tags = set(get_tag(rule.get(field)) for rule in self.rules
+            for field in ('tag', 'add_after', 'add_before') if rule.get(field))
+        if len(tags) < 2:
+            return {}
+        return dict((href_key(rule.href), rule)
+                    for rule in policy.fw_ipv4_access_rules)
+        
+    def changed_rules(self, policy):
+        """
+        Return the rules that are not known to be unchanged. Rules are
+        compared by fingerprint with the current rule found by tag, which
+        does not require resolving any elements referenced by the rule.
+        
+        :param FirewallPolicy policy: policy reference
+        :rtype: list
+        """
+        rules = []
+        cache = Cache()
+        for rule in self.rules:
+            if 'tag' in rule and not rule.get('add_after') and \
+                not rule.get('add_before'):
+                current = self.rule_by_tag(policy, rule.get('tag'))
+                if current and is_rule_unchanged(rule, current, cache):
+                    continue
+            rules.append(rule)
+        return rules
         
     def field_resolver(self, elements, types):
         """
@@ -51,6 +51,13 @@ options:
       - destination
       - services
     type: list
+  prefetch:
+    description:
+      - Element types to retrieve in a single query per type before expanding fields.
+        Elements referenced by rules are otherwise retrieved once per element on
+        first use. Only used with I(expand). Provide the element types most commonly
+        used in the policy, for example host, network, group and tcp_service.
+    type: list
   as_yaml:
     description:
       - Set this boolean to true if the output should be exported into yaml format. By
@@ -58,6 +65,15 @@ options:
         also use the provided jinja templates to format into yaml and reuse for playbook
         runs.
     type: bool
+  dest:
+    description:
+      - Write the rules to the specified file instead of returning them as facts.
+        Rules are written as they are retrieved so the full rule set is not held
+        in memory. Files ending in C(.json) are written in json format, otherwise
+        the file is written in yaml format using the same structure as returned in
+        the facts. The facts will contain the policy, dest and the number of rules
+        written.
+    type: str
   
 extends_documentation_fragment:
   - stonesoft
@@ -99,6 +115,12 @@ EXAMPLES = '''
       - destinations
       - services
 
+  - name: Export all rules of a large policy to file in yaml format
+    firewall_rule_facts:
+      filter: TestPolicy
+      as_yaml: true
+      dest: /tmp/TestPolicy.yml
+
   - name: Get specific rules based on range order (rules 1-10)
     firewall_rule_facts:
       filter: TestPolicy
@@ -162,12 +184,15 @@ firewall_rule:
         "template": "Firewall Inspection Template"
     }]
 '''
+import json
 import traceback
-from ansible.module_utils.stonesoft_util import StonesoftModuleBase
+from itertools import islice
+from ansible.module_utils.stonesoft_util import StonesoftModuleBase, Cache
 
 try:
     from smc.api.exceptions import SMCException
     from smc.policy.layer3 import FirewallPolicy
+    from smc.base.model import Element
 except ImportError:
     pass
 
@@ -176,7 +201,20 @@ engine_type = ('single_fw', 'single_layer2', 'single_ips', 'virtual_fw',
     'fw_cluster', 'master_engine')
 
 
-def to_yaml(rule, expand=None):
+def rule_to_yaml(rule, expand=None, cache=None):
+    """
+    Return a dict representation of a firewall rule in the format used
+    by the firewall_rule module. Sources, destinations and services are
+    returned as hrefs unless the field is in expand, in which case they
+    are returned as names keyed by element type.
+    
+    :param Rule rule: rule fetched from policy
+    :param list expand: fields to expand
+    :param Cache cache: optional cache used to resolve hrefs of expanded
+        fields. Elements referenced by more than one rule are then only
+        fetched once.
+    :rtype: dict
+    """
     _rule = {
         'name': rule.name, 'tag': rule.tag,
         'is_disabled': rule.is_disabled,
@@ -193,7 +231,14 @@ def to_yaml(rule, expand=None):
         else:
             if expand and field in expand:
                 tmp = {}
-                for entry in getattr(rule, field).all():
+                if cache is not None:
+                    entries = [cache.get_href(href)
+                        for href in getattr(rule, field).all_as_href()]
+                else:
+                    entries = getattr(rule, field).all()
+                for entry in entries:
+                    if entry is None:
+                        continue
                     element_type = entry.typeof
                     if entry.typeof in engine_type:
                         element_type = 'engine'
@@ -236,6 +281,52 @@ def to_yaml(rule, expand=None):
     return _rule
 
 
+def detached(rules):
+    """
+    New rule elements from the metadata of the rules. The rule collection
+    keeps a reference to each listed rule, so a rule document loaded
+    through it stays in memory until the run completes. The document of a
+    new rule element is freed once the rule has been serialized.
+    
+    :param rules: iterable of rules
+    :return: generator of rules
+    """
+    for rule in rules:
+        yield Element.from_meta(name=rule.name, href=rule.href, type=rule.typeof)
+
+
+def write_rules(dest, policy, rules):
+    """
+    Write rules to file as they are serialized.
+    
+    :param str dest: path of file
+    :param str policy: name of policy
+    :param rules: iterable of rule dicts
+    :return: number of rules written
+    :rtype: int
+    """
+    count = 0
+    with open(dest, 'w') as f:
+        if dest.endswith('.json'):
+            f.write('{"policy": %s, "rules": [' % json.dumps(policy))
+            for count, rule in enumerate(rules, 1):
+                if count > 1:
+                    f.write(',')
+                f.write('\n')
+                f.write(json.dumps(rule, sort_keys=True))
+            f.write('\n]}\n')
+        else:
+            import yaml
+            f.write(yaml.safe_dump({'policy': policy}, default_flow_style=False))
+            for count, rule in enumerate(rules, 1):
+                if count == 1:
+                    f.write('rules:\n')
+                f.write(yaml.safe_dump([rule], default_flow_style=False))
+            if not count:
+                f.write('rules: []\n')
+    return count
+
+
 expands = ('sources', 'destinations', 'services')
 
         
@@ -245,12 +336,17 @@ class FirewallRuleFacts(StonesoftModuleBase):
         self.module_args = dict(
             filter=dict(type='str', required=True),
             expand=dict(type='list', default=[]),
+            prefetch=dict(type='list', default=[]),
             search=dict(type='str'),
-            rule_range=dict(type='str')
+            rule_range=dict(type='str'),
+            dest=dict(type='str')
         )
     
         self.expand = None
+        self.prefetch = None
+        self.cache = None
         self.search = None
+        self.dest = None
         self.limit = None
         self.filter = None
         self.as_yaml = None
@@ -278,7 +374,7 @@ class FirewallRuleFacts(StonesoftModuleBase):
                 self.fail(msg='Invalid expandable attribute: %s provided. Valid '
                     'options are: %s'  % (attr, expands))
         
-        rules = []
+        firewall_rule = {}
         try:
             policy = self.search_by_type(FirewallPolicy)
             if not policy:
@@ -290,12 +386,18 @@ class FirewallRuleFacts(StonesoftModuleBase):
     
             policy = policy.pop()
             
+            if self.expand:
+                # Referenced elements are resolved once per run
+                self.cache = Cache(max_concurrency=self.smc_max_concurrency)
+                for typeof in self.prefetch:
+                    self.cache.add_type(typeof)
+            
             if self.search:
                 result = policy.search_rule(self.search)
             elif self.rule_range:
                 try:
                     start, end = map(int, self.rule_range.split('-'))
-                    result= [x for x in policy.fw_ipv4_access_rules][start-1:end]
+                    result = islice(policy.fw_ipv4_access_rules, max(start-1, 0), end)
                 except ValueError:
                     raise SMCException('Value of rule range was invalid. Rule ranges '
                         'must be a string with numeric only values, got: %s' %
@@ -304,25 +406,36 @@ class FirewallRuleFacts(StonesoftModuleBase):
                 result = policy.fw_ipv4_access_rules
             
             if self.as_yaml:
-                rules = [to_yaml(rule, self.expand) for rule in result]
+                rules = (rule_to_yaml(rule, self.expand, self.cache)
+                         for rule in detached(result))
             else:
                 # No order for since rules could be sliced or searched
                 if self.search or self.rule_range:
-                    rules = [{'name': rule.name, 'type': rule.typeof} for rule in result]
+                    rules = ({'name': rule.name, 'type': rule.typeof} for rule in result)
                 else:
-                    rules = [{'name': rule.name, 'type': rule.typeof, 'pos': num}
-                              for num, rule in enumerate(result, 1)]
+                    rules = ({'name': rule.name, 'type': rule.typeof, 'pos': num}
+                              for num, rule in enumerate(result, 1))
+            
+            if self.dest:
+                try:
+                    count = write_rules(self.dest, policy.name, rules)
+                except (IOError, OSError) as e:
+                    self.fail(msg='Failed writing rules to file: %s' % str(e))
+                firewall_rule = {
+                    'policy': policy.name,
+                    'dest': self.dest,
+                    'rule_count': count}
+            else:
+                firewall_rule = {
+                    'policy': policy.name,
+                    'rules': list(rules)}
         
         except SMCException as err:
             self.fail(msg=str(err), exception=traceback.format_exc())
-        
-        firewall_rule = {
-            'policy': policy.name,
-            'rules': rules}
     
         self.results['ansible_facts']['firewall_rule'].append(firewall_rule)
         return self.results
-        
+    
         
 def main():
     FirewallRuleFacts()
@@ -27,6 +27,11 @@ description:
     and re-run. For groups, you can reference a member by name which will require it to
     exist, or you can also specify the required options and create the element if it
     doesn't exist.
+  - Groups and netlinks can reference other elements created by the same task,
+    including other groups. Elements are created after the elements they reference,
+    elements that do not depend on each other are created in parallel by up to
+    I(smc_max_concurrency) workers. Elements that reference each other in a cycle
+    are reported before any element is created.
 
 version_added: '2.5'
 
@@ -452,19 +457,22 @@ class NetworkElement(StonesoftModuleBase):
         
         try:
             if state == 'present':
-                deferred_elements = ('group', 'netlink')
                 # Validate elements before proceeding.
-                groups, netlinks = [], []
                 for element in self.elements:
                     self.is_element_valid(element, ELEMENT_TYPES)
-                    if 'group' in element:
-                        groups.append(element)
-                    elif 'netlink' in element:
-                        netlinks.append(element)
                 
-                if groups or netlinks:
-                    to_be_created = self.to_be_created_elements()
-                    self.cache = Cache()
+                groups = [element for element in self.elements if 'group' in element]
+                netlinks = [element for element in self.elements if 'netlink' in element]
+                for netlink in netlinks:
+                    self.is_netlink_valid(netlink)
+                
+                to_be_created = self.to_be_created_elements()
+                levels, cycle = self.creation_levels(to_be_created)
+                if cycle:
+                    self.fail(msg='Elements reference each other and cannot be created: %s'
+                        % ' -> '.join('%s %s' % key for key in cycle))
+                
+                self.cache = Cache(max_concurrency=self.smc_max_concurrency)
                 
                 if groups:
                     self.enum_group_members(groups, to_be_created)
@@ -477,54 +485,16 @@ class NetworkElement(StonesoftModuleBase):
                     if self.cache.missing:
                         self.fail(msg='Netlink elements referenced are missing and are not being '
                             'created in this playbook: %s' % self.cache.missing)
-
-                for element in self.elements:
-                    for typeof, _ in element.items():
-                        if typeof not in deferred_elements:
-                            result = update_or_create(
-                                element, ELEMENT_TYPES, check_mode=self.check_mode)
-                            self.results['state'].append(result)
-
-                for group in groups:
-                    # Run through cache again, entries that exist will not be
-                    # added twice but this captures elements that might have been
-                    # added earlier by the playbook run
-                    _group = copy.deepcopy(group)
-                    members = _group.get('group', {}).get('members', {}) 
-                    if members:
-                        self.cache.add_many([members])
-                        # Add to new members list
-                        _members = [self.cache.get(typeof, value)
-                            for typeof, member in members.items()
-                            for value in member]
-                    else: # No members defined
-                        _members = []
-
-                    _group.setdefault('group', {}).update(
-                        members=_members)
-                    
-                    result = update_or_create(_group, ELEMENT_TYPES, check_mode=self.check_mode)
-                    self.results['state'].append(result)
                 
-                for netlink in netlinks:
-                    _netlink = copy.deepcopy(netlink)
-                    gateway = _netlink.get('netlink', {}).get('gateway')
-                    self.cache._add_entry(gateway.get('type'), gateway.get('name'))
-                    _netlink.setdefault('netlink').update(
-                        gateway=self.cache.get(
-                            gateway.get('type'), gateway.get('name')))
-                    
-                    # Update networks
-                    networks = _netlink.get('netlink').get('network')
-                    for net in networks:
-                        self.cache._add_entry('network', net)
-                    _netlink.setdefault('netlink').update(
-                        network=[self.cache.get('network', net)
-                            for net in networks])
-                    
-                    result = update_or_create(
-                        _netlink, ELEMENT_TYPES, check_mode=self.check_mode)
-                    self.results['state'].append(result)
+                def create(element):
+                    return update_or_create(
+                        self.resolve_references(element), ELEMENT_TYPES,
+                        check_mode=self.check_mode, cache=self.cache)
+                
+                # Elements in a level only reference elements of previous
+                # levels or existing elements so they are created in parallel
+                for level in levels:
+                    self.results['state'].extend(self.cache._map(create, level))
                     
                 if self.check_mode:
                     return self.results
@@ -562,14 +532,127 @@ class NetworkElement(StonesoftModuleBase):
         :return: dict of element by type: set([names]) to be created
         :rtype: dict
         """
-        nested_element = ('netlink', 'group')
         to_be_created = {} # dict of element by type: set([names]) to be created.
         for element in self.elements:
             for typeof, values in element.items():
-                if typeof not in nested_element:
-                    to_be_created.setdefault(typeof, set()).add(
-                        values.get('name'))
+                to_be_created.setdefault(typeof, set()).add(
+                    values.get('name'))
         return to_be_created
+    
+    def references(self, element):
+        """
+        Elements referenced by a group or netlink, as (typeof, name)
+        tuples.
+        
+        :param dict element: element dict, key is typeof element
+        :rtype: list
+        """
+        refs = []
+        for typeof, values in element.items():
+            if typeof == 'group':
+                members = values.get('members') or {}
+                for member_type, member in members.items():
+                    refs.extend((member_type, name) for name in member)
+            elif typeof == 'netlink':
+                gateway = values['gateway']
+                refs.append((gateway.get('type'), gateway.get('name')))
+                refs.extend(('network', network) for network in values['network'])
+        return refs
+    
+    def creation_levels(self, pending_elements):
+        """
+        Order elements so each element is created after the elements it
+        references that are also created by this playbook. Elements are
+        returned in levels, where the first level has no references to
+        pending elements and each following level only references elements
+        from previous levels. Within a level elements keep the playbook
+        order.
+        
+        If elements reference each other, nothing can be created and the
+        elements forming the cycle are returned instead.
+        
+        :param dict pending_elements: elements waiting to be created
+        :return: tuple of list of levels, list of (typeof, name) forming a
+            cycle or None
+        """
+        keys = [next(((typeof, values.get('name'))
+                      for typeof, values in element.items()), None)
+                for element in self.elements]
+        by_key = {}
+        for index, key in enumerate(keys):
+            by_key.setdefault(key, []).append(index)
+        
+        # Edges from each pending element to the elements that reference it
+        dependents = [[] for _ in self.elements]
+        waiting_on = [0] * len(self.elements)
+        for index, element in enumerate(self.elements):
+            for ref in set(self.references(element)):
+                if ref[1] in pending_elements.get(ref[0], set()):
+                    for dependency in by_key.get(ref, []):
+                        dependents[dependency].append(index)
+                        waiting_on[index] += 1
+        
+        levels = []
+        ready = [index for index, count in enumerate(waiting_on) if not count]
+        while ready:
+            levels.append([self.elements[index] for index in ready])
+            next_ready = []
+            for index in ready:
+                for dependent in dependents[index]:
+                    waiting_on[dependent] -= 1
+                    if not waiting_on[dependent]:
+                        next_ready.append(dependent)
+            ready = sorted(next_ready)
+        
+        if not any(waiting_on):
+            return levels, None
+        
+        # Every remaining element still waits on another remaining element,
+        # follow those until an element repeats to find a cycle
+        waits_for = {}
+        for index, targets in enumerate(dependents):
+            for dependent in targets:
+                if waiting_on[index] and waiting_on[dependent]:
+                    waits_for.setdefault(dependent, index)
+        path = [next(index for index, count in enumerate(waiting_on) if count)]
+        while path.count(path[-1]) < 2:
+            path.append(waits_for[path[-1]])
+        cycle = path[path.index(path[-1]):]
+        return levels, [keys[index] for index in cycle]
+    
+    def resolve_references(self, element):
+        """
+        Replace member and gateway names of groups and netlinks with the
+        elements from cache. Referenced elements are either existing
+        elements or elements created in a previous level and stored in
+        cache by `update_or_create`. In check mode the element is only
+        fetched so references are not resolved.
+        
+        :param dict element: element dict, key is typeof element
+        :return: element dict ready for `update_or_create`
+        """
+        if self.check_mode or ('group' not in element and 'netlink' not in element):
+            return element
+        
+        # Elements that were not found in check mode or that could not be
+        # created are searched again
+        self.cache.add_many([{typeof: [name]}
+            for typeof, name in self.references(element)])
+        
+        _element = copy.deepcopy(element)
+        if 'group' in _element:
+            members = _element['group'].get('members') or {}
+            _element['group'].update(
+                members=[self.cache.get(typeof, value)
+                    for typeof, member in members.items()
+                    for value in member])
+        else:
+            gateway = _element['netlink']['gateway']
+            _element['netlink'].update(
+                gateway=self.cache.get(gateway.get('type'), gateway.get('name')),
+                network=[self.cache.get('network', net)
+                    for net in _element['netlink']['network']])
+        return _element
         
     def enum_group_members(self, groups, pending_elements):
         """
@@ -583,13 +666,35 @@ class NetworkElement(StonesoftModuleBase):
         :param dict pending_elements: elements waiting to be created
         :return: None
         """
-        for group in groups:
-            members = group.get('group', {}).get('members', {})
-            members = {} if members is None else members
-            for typeof, member in members.items():
-                for name in member:
-                    if name not in pending_elements.get(typeof, set()):
-                        self.cache._add_entry(typeof, name)
+        self.cache.add_many([{typeof: [name]}
+            for group in groups
+            for typeof, name in self.references(group)
+            if name not in pending_elements.get(typeof, set())])
+    
+    def is_netlink_valid(self, netlink):
+        """
+        Netlinks reference nested elements gateway and networks. Validate
+        the format of these references.
+        
+        :param dict netlink: netlink extracted from elements
+        :return: None
+        """
+        values = netlink.get('netlink', [])
+        for req in ('gateway', 'network'):
+            if req not in values:
+                self.fail(msg='Netlink requires a gateway and list of networks, '
+                    'received: %s' % values)
+        gateway = values['gateway']
+        if not isinstance(gateway, dict) or 'name' not in gateway or 'type' not in gateway:
+            self.fail(msg='Netlink gateway must be a dict with a name and type key value: %s'
+                % gateway)
+        if gateway.get('type') not in ('engine', 'router'):
+            self.fail(msg='Netlink types can only be of type engine or router, got: %s' %
+                gateway.get('type'))
+        
+        networks = values['network']
+        if not isinstance(networks, list):
+            self.fail(msg='Netlink networks must be defined as a list, got: %s' % type(networks))
     
     def enum_netlink_members(self, netlinks, pending_elements):
         """
@@ -600,31 +705,10 @@ class NetworkElement(StonesoftModuleBase):
         
         :return: None
         """
-        for netlink in netlinks:
-            values = netlink.get('netlink', [])
-            for req in ('gateway', 'network'):
-                if req not in values:
-                    self.fail(msg='Netlink requires a gateway and list of networks, '
-                        'received: %s' % values)
-            # Add requirements to cache
-            gateway = values['gateway']
-            if not isinstance(gateway, dict) or 'name' not in gateway or 'type' not in gateway:
-                self.fail(msg='Netlink gateway must be a dict with a name and type key value: %s'
-                    % gateway)
-            if gateway.get('type') not in ('engine', 'router'):
-                self.fail(msg='Netlink types can only be of type engine or router, got: %s' %
-                    gateway.get('type'))
-            
-            networks = values['network']
-            if not isinstance(networks, list):
-                self.fail(msg='Netlink networks must be defined as a list, got: %s' % type(networks))
-            
-            if gateway.get('name') not in pending_elements.get(gateway.get('type'), set()):
-                self.cache._add_entry(gateway.get('type'), gateway.get('name'))
-            
-            for network in networks:
-                if network not in pending_elements.get('network', set()):
-                    self.cache._add_entry('network', network)
+        self.cache.add_many([{typeof: [name]}
+            for netlink in netlinks
+            for typeof, name in self.references(netlink)
+            if name not in pending_elements.get(typeof, set())])
 
 
 def main():
@@ -25,7 +25,41 @@ version_added: '2.5'
 options:
   name:
     description:
-      - Name of the engine to deploy policy on
+      - Name of the engine to deploy policy on. Mutually exclusive with
+        I(engines) and I(engine_filter)
+    type: str
+  engines:
+    description:
+      - List of engines to deploy policy on. Policy tasks are started on up to
+        I(max_concurrent) engines at a time and the status of all running tasks
+        is checked from a single loop.
+    type: list
+  engine_filter:
+    description:
+      - Deploy policy on all engines matching the filter. The filter matches
+        against the engine name and comment fields.
+    type: str
+  only_if_pending:
+    description:
+      - Only refresh or upload policy when the engine has pending changes.
+        An upload of a policy other than the installed policy is always done.
+        Engines without pending changes are reported as skipped. If the SMC
+        or engine does not support pending changes, the policy is deployed.
+    type: bool
+    default: false
+  max_concurrent:
+    description:
+      - Max number of policy tasks to run at the same time when deploying to
+        multiple engines
+    type: int
+    default: 10
+  fail_fast:
+    description:
+      - When deploying to multiple engines, do not start tasks on remaining
+        engines once a task has failed. Tasks that are already running are
+        waited for and engines that were not started are reported as skipped.
+    type: bool
+    default: false
   policy:
     description:
       - A policy to deploy. If the engine does not have an existing policy
@@ -34,14 +68,42 @@ options:
     type: str
   sleep:
     description:
-      - Amount of time to sleep between checking the task status
+      - Max amount of time to sleep between checking the task status. Status
+        checks start at I(poll_interval) and back off exponentially up to
+        this value.
     type: int
     default: 3 sec
+  poll_interval:
+    description:
+      - Seconds between status checks during the initial fast poll phase.
+        Short refreshes are usually done within a few seconds, so the first
+        checks are made quickly before backing off.
+    type: float
+    default: 0.5
+  fast_polls:
+    description:
+      - Number of status checks made every I(poll_interval) seconds before
+        the interval starts to back off
+    type: int
+    default: 4
+  backoff:
+    description:
+      - Factor the interval between status checks is multiplied by after the
+        fast poll phase, capped at I(sleep). Each interval is varied by a
+        random jitter of up to 10% either way so concurrent tasks do not poll
+        the SMC in lock step.
+    type: float
+    default: 2
+  timeout:
+    description:
+      - Overall deadline in seconds for a policy task to finish. Defaults to
+        max_tries * sleep.
+    type: int
   max_tries:
     description:
       - Max number of times to loop through status checks. In case the policy
         is in 'wait' status (i.e. no connectivity to engine), this will only
-        block for max_tries * sleep
+        block for max_tries status checks or until I(timeout)
     type: int
     default: 36
   wait_for_finish:
@@ -83,6 +145,30 @@ EXAMPLES = '''
       wait_for_finish: yes
       max_tries: 10
       sleep: 3
+
+- name: Refresh policy on many engines
+  hosts: localhost
+  gather_facts: no
+  tasks:
+  - name: Refresh policy on all engines with name starting with branch
+    policy_push:
+      engine_filter: branch
+      max_concurrent: 20
+      fail_fast: yes
+
+- name: Nightly convergence, refresh only engines with changes
+  hosts: localhost
+  gather_facts: no
+  tasks:
+  - name: Refresh policy on engines with pending changes
+    policy_push:
+      engine_filter: branch
+      only_if_pending: yes
+    register: push
+  
+  - name: Engines without pending changes
+    debug:
+      msg: "{{ push.skipped_engines }}"
 '''
 
 RETURN = '''
@@ -94,116 +180,323 @@ msg:
   description: Message returned when policy task returns
   return: always
   type: str
+skipped_engines:
+  description: Names of engines where the policy task was not run, either
+    because there were no pending changes or due to fail_fast
+  returned: always
+  type: list
+  sample: ["fw2"]
+status_calls:
+  description: Number of task status checks made against the SMC
+  returned: always
+  type: int
+  sample: 7
+wait_time:
+  description: Total seconds spent waiting between task status checks
+  returned: always
+  type: float
+  sample: 12.4
+engines:
+  description: Result of the policy task for each engine
+  returned: always
+  type: list
+  sample: [
+    {
+        "action": "refresh",
+        "duration": 48.12,
+        "failed": false,
+        "msg": "Operation completed",
+        "name": "fw1",
+        "status_calls": 19
+    },
+    {
+        "action": "refresh",
+        "duration": 0,
+        "failed": false,
+        "msg": "Skipped after a previous task failed",
+        "name": "fw2",
+        "skipped": true
+    }]
 '''
 
 
+import time
+import random
 import traceback
+from collections import deque
 from ansible.module_utils.stonesoft_util import StonesoftModuleBase
 
 
 try:
     from smc.core.engine import Engine
-    from smc.api.exceptions import SMCException
+    from smc.base.collection import Search
+    from smc.api.exceptions import SMCException, ElementNotFound, \
+        UnsupportedEngineFeature
 except ImportError:
     pass
 
 
+class Backoff(object):
+    """
+    Intervals between task status checks. The first `fast_polls` intervals
+    are `initial` seconds, after which the interval is multiplied by
+    `factor` up to `maximum`. Each interval is varied by a random jitter
+    of up to 10 percent either way, so the average interval is unchanged.
+    
+    :param float initial: interval during the fast poll phase
+    :param float maximum: max interval
+    :param float factor: backoff multiplier
+    :param int fast_polls: number of intervals before backing off
+    """
+    def __init__(self, initial, maximum, factor=2, fast_polls=0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.fast_polls = fast_polls
+        self.calls = 0
+        self.interval = initial
+    
+    def next(self):
+        """
+        Return the next interval in seconds
+        
+        :rtype: float
+        """
+        # Stop growing once capped so long running tasks do not overflow
+        if self.calls >= self.fast_polls and self.interval < self.maximum:
+            self.interval *= self.factor
+        self.calls += 1
+        return min(self.interval, self.maximum) * random.uniform(0.9, 1.1)
+    
+
 class PolicyDeploy(StonesoftModuleBase):
     def __init__(self):
         
         self.module_args = dict(
-            name=dict(type='str', required=True),
+            name=dict(type='str'),
+            engines=dict(type='list'),
+            engine_filter=dict(type='str'),
             policy=dict(type='str'),
             sleep=dict(default=3, type='int'),
+            poll_interval=dict(default=0.5, type='float'),
+            fast_polls=dict(default=4, type='int'),
+            backoff=dict(default=2, type='float'),
+            timeout=dict(type='int'),
             max_tries=dict(default=36, type='int'),
+            max_concurrent=dict(default=10, type='int'),
+            fail_fast=dict(default=False, type='bool'),
+            only_if_pending=dict(default=False, type='bool'),
             wait_for_finish=dict(type='bool', default=True),
         )
         
         self.name = None
+        self.engines = None
+        self.engine_filter = None
         self.policy= None
         self.sleep = None
+        self.poll_interval = None
+        self.fast_polls = None
+        self.backoff = None
+        self.timeout = None
         self.max_tries = None
+        self.max_concurrent = None
+        self.fail_fast = None
+        self.only_if_pending = None
         self.wait_for_finish= None
         
+        mutually_exclusive = [
+            ['name', 'engines', 'engine_filter'],
+        ]
+        
+        required_one_of = [
+            ['name', 'engines', 'engine_filter']
+        ]
+        
         self.results = dict(
             failed=False,
-            msg=''
+            msg='',
+            engines=[],
+            skipped_engines=[],
+            status_calls=0,
+            wait_time=0
         )
-        super(PolicyDeploy, self).__init__(self.module_args)
+        super(PolicyDeploy, self).__init__(self.module_args,
+            mutually_exclusive=mutually_exclusive, required_one_of=required_one_of)
     
     def exec_module(self, **kwargs):
         for name, value in kwargs.items():
             setattr(self, name, value)
         
-        failed = False
+        try:
+            if self.engine_filter:
+                engines = [engine.name for engine in Search.objects\
+                    .context_filter('engine_clusters').filter(self.engine_filter)]
+            else:
+                engines = self.engines or [self.name]
+            
+            results = self.deploy(engines)
+        
+        except SMCException as err:
+            self.fail(msg=str(err), exception=traceback.format_exc())
+        
+        failed = [result['name'] for result in results if result['failed']]
+        skipped = [result['name'] for result in results if result.get('skipped')]
+        if self.name:
+            self.results['msg'] = results[0]['msg']
+        elif failed:
+            self.results['msg'] = 'Policy task failed on engines: %s' % failed
+        else:
+            self.results['msg'] = 'Policy task completed on %s engines, %s skipped' % (
+                len(results) - len(skipped), len(skipped))
+        
+        self.results.update(
+            failed=bool(failed),
+            engines=results,
+            skipped_engines=skipped,
+            status_calls=sum(result.get('status_calls', 0) for result in results))
+        return self.results
+    
+    def deploy(self, engines):
+        """
+        Start the policy task on each engine, keeping at most max_concurrent
+        tasks running when waiting for tasks to finish. Each running task is
+        polled on its own backoff schedule until it completes, has been
+        polled max_tries times or the timeout expires.
+        
+        :param list engines: names of engines
+        :return: list of results, in the order of engines
+        :rtype: list(dict)
+        """
+        results = [dict(name=name, failed=False, msg='') for name in engines]
+        pending = deque(results)
+        running = []
+        timeout = self.timeout or self.sleep * self.max_tries
+        
+        while pending or running:
+            while pending and (not self.wait_for_finish or
+                len(running) < max(self.max_concurrent, 1)):
+                
+                if self.fail_fast and any(r['failed'] for r in results):
+                    for result in pending:
+                        result.update(
+                            skipped=True, duration=0,
+                            msg='Skipped after a previous task failed')
+                    pending.clear()
+                    break
+                
+                result = pending.popleft()
+                poller = self.start_task(result)
+                if poller is None:
+                    continue
+                
+                if self.wait_for_finish:
+                    start = time.time()
+                    backoff = Backoff(
+                        self.poll_interval, self.sleep, self.backoff, self.fast_polls)
+                    running.append(dict(
+                        result=result, task=poller.task, start=start,
+                        deadline=start + timeout, backoff=backoff,
+                        next_poll=start + backoff.next()))
+                elif poller.task.in_progress:
+                    result['msg'] = 'Task %s currently in progress. Check the engine ' \
+                        'facts to determine if any pending changes remain.' % result['action']
+                else:
+                    result.update(
+                        failed=True,
+                        msg='Task did not report positive status when starting. '
+                            'Returned status was %s' % poller.task.last_message)
+            
+            if not running:
+                continue
+            
+            delay = min(entry['next_poll'] for entry in running) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+                self.results['wait_time'] += delay
+            
+            now = time.time()
+            for entry in [e for e in running if e['next_poll'] <= now]:
+                entry['task'] = entry['task'].update_status()
+                task, backoff = entry['task'], entry['backoff']
+                now = time.time()
+                if not task.in_progress or backoff.calls >= self.max_tries or \
+                    now >= entry['deadline']:
+                    running.remove(entry)
+                    entry['result'].update(
+                        msg=task.last_message,
+                        status_calls=backoff.calls,
+                        duration=round(now - entry['start'], 2))
+                    if task.in_progress:
+                        entry['result'].update(in_progress=True)
+                    elif task.success is False:
+                        entry['result'].update(failed=True)
+                else:
+                    entry['next_poll'] = min(now + backoff.next(), entry['deadline'])
+        
+        self.results['wait_time'] = round(self.results['wait_time'], 2)
+        return results
+    
+    def start_task(self, result):
+        """
+        Start an upload if a policy is specified, otherwise a refresh
+        of the installed policy. Failures to start the task are set on
+        the result.
         
+        :param dict result: result for the engine
+        :return: poller for the task or None if the task was not started
+        :rtype: TaskOperationPoller
+        """
         try:
-            engine = Engine.get(self.name)
-            msg = ''
+            engine = Engine.get(result['name'])
             # If policy is defined, run an upload on the policy
             # TODO: Address situation where policy is queued for
             # uninitialized engine and attempted twice. This will
             # succeed but SMC 6.3 will return ''
             if self.policy:
-                if self.wait_for_finish:
-                    task = engine.upload(
-                        self.policy,
-                        timeout=self.sleep,
-                        wait_for_finish=True,
-                        max_tries=self.max_tries)
-                    
-                    while not task.done():
-                        task.wait(self.sleep)
-                    
-                    msg = task.last_message()
-                
-                else:
-                    task = engine.upload(self.policy)
-                    
-                    if task.task.in_progress:
-                        msg = 'Task upload currently in progress. Check the engine ' \
-                            'facts to determine if any pending changes remain.'
-                    else:
-                        msg ='Task did not report positive status when starting. ' \
-                            'Returned status was %s' % task.last_message()
-                        failed = True
-
-            else: # A refresh of already installed policy
-                if engine.installed_policy:
-                    if self.wait_for_finish:
-                        task = engine.refresh(
-                            timeout=self.sleep,
-                            wait_for_finish=True,
-                            max_tries=self.max_tries)
-                        
-                        while not task.done():
-                            task.wait(self.sleep)
-                    
-                        msg = task.last_message()
-                    else:
-                        if engine.installed_policy:
-                            task = engine.refresh()
-                            
-                            if task.task.in_progress:
-                                msg = 'Task refresh currently in progress. Check the engine ' \
-                                    'facts to determine if any pending changes remain.'
-                            else:
-                                msg ='Task did not report positive status when starting. ' \
-                                    'Returned status was %s' % task.last_message()
-                                failed = True
-                else:
-                    msg = 'Engine does not currently have a policy assigned, you must ' \
-                        'specify a policy to upload before refreshing policy.'
-                    failed = True
-                        
-
-            self.results['msg'] = msg
-
+                result['action'] = 'upload'
+                if self.only_if_pending and self.policy == engine.installed_policy \
+                    and not self.has_pending_changes(engine):
+                    return self.skip(result)
+                return engine.upload(self.policy)
+            
+            # A refresh of already installed policy
+            result['action'] = 'refresh'
+            if engine.installed_policy:
+                if self.only_if_pending and not self.has_pending_changes(engine):
+                    return self.skip(result)
+                return engine.refresh()
+            
+            result.update(
+                failed=True,
+                msg='Engine does not currently have a policy assigned, you must '
+                    'specify a policy to upload before refreshing policy.')
+        
+        except ElementNotFound as err:
+            result.update(failed=True, msg=str(err))
         except SMCException as err:
-            self.fail(msg=str(err), exception=traceback.format_exc())
+            if self.name:
+                raise
+            result.update(failed=True, msg=str(err))
+    
+    def skip(self, result):
+        result.update(
+            skipped=True, duration=0,
+            msg='No pending changes on engine, policy %s skipped' % result['action'])
+    
+    def has_pending_changes(self, engine):
+        """
+        Whether the engine has changes that have not been deployed. Engines
+        that do not support pending changes are assumed to have changes.
         
-        self.results['failed'] = failed
-        return self.results
+        :param Engine engine: engine to check
+        :rtype: bool
+        """
+        try:
+            for _ in engine.pending_changes:
+                return True
+        except UnsupportedEngineFeature:
+            return True
+        return False
     
 
 def main():
@@ -211,5 +504,3 @@ def main():
     
 if __name__ == '__main__':
     main()
-
-
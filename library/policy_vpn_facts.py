@@ -18,6 +18,11 @@ description:
   - A Policy VPN provides IPSEC functionality between either SMC managed or non
     managed devices. This will represent central and satllite gateways in the
     VPN configuration.
+  - The policy VPN is read without being opened for edit, so it is not locked
+    while it is exported. Gateways are listed once per gateway type and the
+    gateway nodes, VPN sites, site elements and tunnels of the VPN are fetched
+    with up to I(smc_max_concurrency) requests at a time. Each element is
+    fetched once per run, even if it is referenced by several VPNs.
 
 version_added: '2.5'
 
@@ -100,71 +105,128 @@ policy_vpn:
     ]
 '''
 
+import collections
 from ansible.module_utils.six import string_types
 from ansible.module_utils.stonesoft_util import (
     StonesoftModuleBase,
+    Cache,
     format_element)
 
 
 try:
-    from smc.vpn.policy import PolicyVPN
+    from smc.vpn.policy import PolicyVPN, GatewayNode
 except ImportError:
     pass
 
 
-def to_dict(vpn, expand=None):
+class VPNCache(Cache):
     """
-    Flatten the policy VPN
+    Cache shared between the policy VPNs exported. Gateways are listed
+    once per type and elements referenced by the VPNs are fetched
+    concurrently and kept by href for the run.
+    """
+    gateway_types = ('internal_gateway', 'external_gateway')
+    
+    def prefetch(self):
+        """
+        List the gateways so the gateway of each node is resolved without
+        fetching it.
+        """
+        self._map(self.add_type, self.gateway_types)
+    
+    def load(self, elements):
+        """
+        Fetch the data of elements that have not been loaded yet, such as
+        sub elements returned by a collection.
+        
+        :param list elements: elements to load
+        :return: elements
+        """
+        self._map(lambda element: element.data, elements)
+        return elements
+    
+    def elements(self, hrefs):
+        """
+        Elements by href with their data loaded. Elements not already
+        cached are fetched concurrently, each href once.
+        
+        :param list hrefs: hrefs of the elements
+        :return: elements, in the order of hrefs
+        :rtype: list(Element)
+        """
+        unique = list(collections.OrderedDict.fromkeys(hrefs))
+        self.load([element for element in self._map(self.get_href, unique)
+                   if element is not None])
+        return [self.get_by_href(href) for href in hrefs]
+
+
+def to_dict(vpn, expand=None, cache=None):
+    """
+    Flatten the policy VPN. The policy is only read, it is not opened
+    for edit. Each level of the VPN is fetched concurrently, gateway
+    nodes first, then their sites, site elements and the tunnels.
     
     :param policy_vpn PolicyVPN
+    :param VPNCache cache: cache shared between policy VPNs
     :return dict
     """
     expand = expand if expand else []
+    cache = cache if cache else VPNCache()
     
-    gateway_cache = {} # Cache gateways to reduce repetitive queries
-    vpn.open()
     if 'vpn_profile' in expand:
-        vpn.data['vpn_profile'] = format_element(vpn.vpn_profile)
-
-    central = []
-    for cgw in vpn.central_gateway_node:
-        gateway_cache[cgw.href] = cgw
-        gateway_cache[cgw.gateway.href] = cgw.gateway
-        
-        vpn_site = []
-        for site in cgw.enabled_sites:
-            if cgw.gateway.name in expand:
-                site.data['site_element'] = [format_element(s) for s in site.vpn_site.site_element]
-                vpn_site.append(format_element(site))
-            else:
-                vpn_site.append(format_element(site.vpn_site))
-
-        central.append({'name': cgw.gateway.name, 'type': cgw.gateway.typeof, 'vpn_site': vpn_site})
+        vpn.data['vpn_profile'] = format_element(
+            cache.elements([vpn.data.get('vpn_profile')])[0])
     
-    satellite = []
-    for sgw in vpn.satellite_gateway_node:
-        gateway_cache[sgw.href] = sgw
-        gateway_cache[sgw.gateway.href] = sgw.gateway
-        
+    central = list(vpn.central_gateway_node)
+    satellite = list(vpn.satellite_gateway_node)
+    mobile = list(vpn.mobile_gateway_node)
+    nodes = cache.load(central + satellite + mobile)
+    
+    gateway_cache = dict(zip( # Gateway by node href
+        [node.href for node in nodes],
+        cache._map(cache.get_href, [node.data['gateway'] for node in nodes])))
+    
+    def gateway(href):
+        if href not in gateway_cache: # Node not listed by the VPN
+            gateway_cache[href] = cache.get_href(GatewayNode(href=href).data['gateway'])
+        return gateway_cache[href]
+    
+    sites = dict(zip(
+        [node.href for node in central + satellite],
+        cache._map(lambda node: list(node.enabled_sites), central + satellite)))
+    cache.load([site for node_sites in sites.values() for site in node_sites])
+    cache.elements([site.data.get('vpn_site')
+        for node_sites in sites.values() for site in node_sites])
+    
+    expanded = [site for node in central + satellite
+        if gateway(node.href).name in expand for site in sites[node.href]]
+    cache.elements([href for site in expanded
+        for href in cache.get_by_href(site.data.get('vpn_site')).data.get('site_element', [])])
+    
+    def gateway_dict(node):
+        gw = gateway(node.href)
         vpn_site = []
-        for site in sgw.enabled_sites:
-            if sgw.gateway.name in expand:
-                site.data['site_element'] = [format_element(s) for s in site.vpn_site.site_element]
+        for site in sites[node.href]:
+            site_element = cache.get_by_href(site.data.get('vpn_site'))
+            if gw.name in expand:
+                site.data['site_element'] = [format_element(cache.get_by_href(s))
+                    for s in site_element.data.get('site_element', [])]
                 vpn_site.append(format_element(site))
             else:
-                vpn_site.append(format_element(site.vpn_site))
-
-        satellite.append({'name': sgw.gateway.name, 'type': sgw.gateway.typeof, 'vpn_site': vpn_site})
+                vpn_site.append(format_element(site_element))
+        return {'name': gw.name, 'type': gw.typeof, 'vpn_site': vpn_site}
+    
+    central = [gateway_dict(cgw) for cgw in central]
+    satellite = [gateway_dict(sgw) for sgw in satellite]
+    mobile_vpn = [gateway(node.href).name for node in mobile]
     
-    mobile_vpn = [mobile.name for mobile in vpn.mobile_gateway_node]
-        
     gateway_tunnel = []
     
-    for tunnel in vpn.tunnels:
+    for tunnel in cache.load(list(vpn.tunnels)):
         tunnel_map = {}
         
-        tunnela = gateway_cache.get(tunnel.data.get('gateway_node_1')).gateway
-        tunnelb = gateway_cache.get(tunnel.data.get('gateway_node_2')).gateway
+        tunnela = gateway(tunnel.data.get('gateway_node_1'))
+        tunnelb = gateway(tunnel.data.get('gateway_node_2'))
        
         tunnel_map.update(
             tunnel_side_a=tunnela.name,
@@ -178,7 +240,6 @@ def to_dict(vpn, expand=None):
     vpn.data.update(central_gateway=central, satellite_gateway=satellite,
                     gateway_tunnel=gateway_tunnel,
                     mobile_vpn_gateway=mobile_vpn)
-    vpn.close()
     return format_element(vpn)
 
 
@@ -213,8 +274,11 @@ class PolicyVPNFacts(StonesoftModuleBase):
 
         result = self.search_by_type(PolicyVPN)
         # Search by specific element type
-        if self.filter:    
-            elements = [to_dict(element, self.expand) for element in result]
+        if self.filter:
+            cache = VPNCache(max_concurrency=self.smc_max_concurrency)
+            if result:
+                cache.prefetch()
+            elements = [to_dict(element, self.expand, cache) for element in result]
         else:
             elements = [{'name': element.name, 'type': element.typeof} for element in result]
         
@@ -229,7 +229,7 @@ class StonesoftRouteMap(StonesoftModuleBase):
         route_map = self.fetch_element(RouteMap)
         
         if state == 'present':
-            cache = Cache()
+            cache = Cache(max_concurrency=self.smc_max_concurrency)
             # Validate rule structure
             cache_ready = self.check_rules()
             cache.add_many(cache_ready)
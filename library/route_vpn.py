@@ -328,7 +328,7 @@ class StonesoftRouteVPN(StonesoftModuleBase):
                         self.fail(msg='A VPN site requires a name to continue')
                     
                     # Get the elements
-                    cache = Cache()
+                    cache = Cache(max_concurrency=self.smc_max_concurrency)
                     cache.add(self.remote_gw.get('vpn_site', {}))
                     if cache.missing:
                         self.fail(msg='Could not find the specified elements for the '
@@ -18,14 +18,71 @@ description:
   - Show the current routing table for the given engine. This will show references
     to the dst_if for the route along with the gateway and route network. Use
     engine_facts to resolve interface ID's returned by this module.
+  - The routing table is streamed from the SMC and routes are filtered as they
+    are received, so only the routes returned are kept in memory. Use the query
+    options on engines with large routing tables. When several query options are
+    provided, routes must match all of them.
+  - When engines are provided, the routing tables of up to I(smc_max_concurrency)
+    engines are read at a time. Use I(snapshot_dir) and I(compare_to) to save the
+    routing tables and verify the routes added and withdrawn after a change.
 
 version_added: '2.5'
 
 options:
   filter:
     description:
-      - Specify the name of the engine in order to find the routing table
-    required: true
+      - Specify the name of the engine in order to find the routing table.
+        Required unless I(engines) is provided.
+    required: false
+  engines:
+    description:
+      - List of engines to find the routing tables of. The routes are returned
+        in I(engine_routes), keyed by engine name. Mutually exclusive with
+        I(filter).
+    type: list
+  snapshot_dir:
+    description:
+      - Directory to save a snapshot of the routes returned for each engine to,
+        in a file named after the engine. Existing snapshots are replaced.
+    type: str
+  compare_to:
+    description:
+      - Directory of snapshots saved previously with I(snapshot_dir). The routes
+        of each engine are compared to its snapshot and only the routes added and
+        withdrawn are returned, in I(route_changes). The module fails if an
+        engine has no snapshot. This can be the same directory as I(snapshot_dir),
+        snapshots are compared before they are replaced.
+    type: str
+  longest_match:
+    description:
+      - List of IP addresses. Only return the routes with the longest prefix
+        containing each address, i.e. the routes the engine uses for the address.
+    type: list
+  contains:
+    description:
+      - List of networks in cidr format or IP addresses. Only return routes for
+        networks that contain or are equal to one of these networks.
+    type: list
+  within:
+    description:
+      - List of networks in cidr format. Only return routes for networks that are
+        within or equal to one of these networks.
+    type: list
+  overlaps:
+    description:
+      - List of networks in cidr format. Only return routes for networks that
+        contain or are within one of these networks.
+    type: list
+  route_type:
+    description:
+      - List of route types to return, for example Static, Connected or Dynamic.
+    type: list
+  limit:
+    description:
+      - Maximum number of routes to return, 0 for all routes. The routing table is
+        not read further once the limit is reached, unless I(longest_match) is used.
+    type: int
+    default: 0
       
 extends_documentation_fragment:
   - stonesoft
@@ -38,10 +95,43 @@ author:
 '''
 
 
+EXAMPLES = '''
+- name: Routes used by the engine for two addresses
+  routing_facts:
+    filter: myfw
+    longest_match:
+      - 8.8.8.8
+      - 10.1.2.3
+
+- name: Static routes within 10.0.0.0/8
+  routing_facts:
+    filter: myfw
+    within:
+      - 10.0.0.0/8
+    route_type:
+      - Static
+    limit: 100
+
+- name: Save the routing tables before a change
+  routing_facts:
+    engines:
+      - myfw
+      - myfw2
+    snapshot_dir: /tmp/routes/before
+
+- name: Routes added and withdrawn by the change
+  routing_facts:
+    engines:
+      - myfw
+      - myfw2
+    compare_to: /tmp/routes/before
+'''
+
+
 RETURN = '''
 routes: 
     description: Return all policy VPNs
-    returned: always
+    returned: when filter is provided without compare_to
     type: list
     sample: [{
         "dst_if": 1, 
@@ -58,58 +148,529 @@ routes:
         "route_type": "Static", 
         "src_if": -1
     }]
+engine_routes:
+    description: Routes of each engine, when engines are provided
+    returned: when engines are provided without compare_to
+    type: dict
+    sample: {
+        "myfw": [{
+            "dst_if": 1, 
+            "route_gateway": "10.0.0.1", 
+            "route_netmask": 0, 
+            "route_network": "0.0.0.0", 
+            "route_type": "Static", 
+            "src_if": -1
+        }]
+    }
+route_changes:
+    description: Routes added and withdrawn on each engine since the snapshot
+    returned: when compare_to is provided
+    type: dict
+    sample: {
+        "myfw": {
+            "added": [{
+                "dst_if": 2, 
+                "route_gateway": "10.0.0.254", 
+                "route_netmask": 24, 
+                "route_network": "172.16.1.0", 
+                "route_type": "Static"
+            }],
+            "withdrawn": []
+        }
+    }
 '''
 
+import os
+import re
+import json
+import socket
+import codecs
+import threading
 import traceback
-from ansible.module_utils.stonesoft_util import StonesoftModuleBase
+from ansible.module_utils.stonesoft_util import StonesoftModuleBase, Cache
 
 
 try:
-    from smc.core.engine import Engine
-    from smc.api.exceptions import SMCException
+    import requests
+    from smc import session
+    from smc.api.exceptions import SMCException, SMCOperationFailure, \
+        EngineCommandFailed
 except ImportError:
     pass
 
 
+# Serializes session refreshes between engines streamed concurrently
+refresh_lock = threading.Lock()
+
+
 def route_dict_from_obj(element):
     return dict(
-        route_gateway=getattr(element, 'route_gateway', None),
-        route_type=element.route_type,
-        src_if=element.src_if,
-        route_netmask=element.route_netmask,
-        dst_if=element.dst_if,
-        route_network=element.route_network)
+        route_gateway=element.get('route_gateway'),
+        route_type=element.get('route_type'),
+        src_if=element.get('src_if'),
+        route_netmask=element.get('route_netmask'),
+        dst_if=element.get('dst_if'),
+        route_network=element.get('route_network'))
+
+
+def parse_prefix(value, length=None):
+    """
+    Parse an IPv4 or IPv6 network in cidr format, or an address which is
+    a host prefix unless length is provided.
+
+    :param str value: network or address
+    :param int length: prefix length if not part of value
+    :raises ValueError: invalid network
+    :return: tuple of (address family, network as int, prefix length)
+    """
+    address, _, prefix = str(value).partition('/')
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    bits = PrefixTrie.bits[family]
+    try:
+        packed = socket.inet_pton(family, address)
+        length = int(prefix or (bits if length is None else length))
+    except (socket.error, ValueError):
+        raise ValueError('Invalid network: %s' % value)
+    if not 0 <= length <= bits:
+        raise ValueError('Invalid prefix length: %s' % value)
+    network = int(codecs.encode(packed, 'hex'), 16)
+    return family, network >> (bits - length) << (bits - length), length
+
+
+class PrefixTrie(object):
+    """
+    Binary trie of IPv4 and IPv6 prefixes. Routes are matched against the
+    prefixes of a query while the routing table is read, so the trie only
+    holds the query and the table is never indexed. Each node is a list of
+    [child 0, child 1, values].
+    """
+    bits = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+    def __init__(self):
+        self.roots = {socket.AF_INET: [None, None, None],
+                      socket.AF_INET6: [None, None, None]}
+
+    def _path(self, prefix, create=False):
+        """
+        Nodes from the root to the node of prefix. The path stops early if
+        the prefix is not in the trie and create is False.
+        """
+        family, network, length = prefix
+        bits = self.bits[family]
+        node = self.roots[family]
+        yield node
+        for depth in range(length):
+            bit = (network >> (bits - depth - 1)) & 1
+            if node[bit] is None:
+                if not create:
+                    return
+                node[bit] = [None, None, None]
+            node = node[bit]
+            yield node
+
+    def insert(self, prefix, value):
+        """
+        :param tuple prefix: prefix from :func:`parse_prefix`
+        :param value: value to store for the prefix
+        """
+        for node in self._path(prefix, create=True):
+            pass
+        node[2] = (node[2] or []) + [value]
+
+    def supernets(self, prefix):
+        """
+        Values of the prefixes containing or equal to prefix
+        """
+        return [value for node in self._path(prefix) for value in node[2] or []]
+
+    def subnets(self, prefix):
+        """
+        Values of the prefixes within or equal to prefix
+        """
+        path = list(self._path(prefix))
+        if len(path) != prefix[2] + 1:
+            return []
+        found, stack = [], [path[-1]]
+        while stack:
+            node = stack.pop()
+            found.extend(node[2] or [])
+            stack.extend(child for child in node[:2] if child is not None)
+        return found
+
+
+def iter_json_array(chunks, key):
+    """
+    Yield the items of the array `key` of a JSON document received in
+    chunks, without loading the whole document.
+
+    :param chunks: iterable of bytes
+    :param str key: name of the array
+    :raises ValueError: document ends before the array
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf, pos, started = '', 0, False
+    while True:
+        if not started:
+            start = buf.find('"%s"' % key)
+            start = buf.find('[', start) if start >= 0 else -1
+            if start >= 0:
+                buf, pos, started = buf[start + 1:], 0, True
+                continue
+        else:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if buf[pos:pos + 1] == ']':
+                return
+            if pos < len(buf):
+                try:
+                    item, pos = decoder.raw_decode(buf, pos)
+                    yield item
+                    continue
+                except ValueError:
+                    pass # Item not received completely
+            buf, pos = buf[pos:], 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            if started:
+                raise ValueError('Routing table ended unexpectedly')
+            return
+        buf += text.decode(chunk)
+
+
+class RouteQuery(object):
+    """
+    Filters applied to the routes as they are read from the routing table.
+    Filters are combined, a route must match all of them. With longest_match,
+    only the routes with the longest prefix for each address are kept while
+    reading, so memory is bounded by the result and not the table.
+
+    :param list longest_match: addresses to find the longest match for
+    :param list contains: routes must contain one of these networks
+    :param list within: routes must be within one of these networks
+    :param list overlaps: routes must contain or be within one of these
+    :param list route_type: route types to keep
+    :param int limit: maximum number of routes, 0 for all
+    :raises ValueError: invalid network or address
+    """
+    def __init__(self, longest_match=None, contains=None, within=None,
+                 overlaps=None, route_type=None, limit=0):
+        self.tries = {}
+        for name, values in (('longest_match', longest_match), ('contains', contains),
+                             ('within', within), ('overlaps', overlaps)):
+            if values:
+                trie = self.tries[name] = PrefixTrie()
+                for value in values:
+                    trie.insert(parse_prefix(value), str(value))
+        self.route_type = set(str(t).lower() for t in route_type or [])
+        self.limit = limit or 0
+
+    def match(self, route):
+        """
+        Whether the route matches the contains, within, overlaps and
+        route_type filters.
+
+        :param dict route: route entry
+        :return: prefix of the route, True if there are no prefix filters
+            or None if it does not match
+        """
+        if self.route_type and \
+            str(route.get('route_type')).lower() not in self.route_type:
+            return None
+        if not self.tries:
+            return True
+        try:
+            prefix = parse_prefix(route.get('route_network'), route.get('route_netmask'))
+        except ValueError:
+            return None
+        if 'contains' in self.tries and not self.tries['contains'].subnets(prefix):
+            return None
+        if 'within' in self.tries and not self.tries['within'].supernets(prefix):
+            return None
+        if 'overlaps' in self.tries and not (self.tries['overlaps'].subnets(prefix) or
+            self.tries['overlaps'].supernets(prefix)):
+            return None
+        return prefix
+
+    def run(self, routes):
+        """
+        Filter routes. Routes are returned in routing table order.
+
+        :param routes: iterable of route entries
+        :rtype: list(dict)
+        """
+        longest = self.tries.get('longest_match')
+        result = []
+        best = {} # address: (prefix length, [(position, route)])
+        for position, route in enumerate(routes):
+            prefix = self.match(route)
+            if prefix is None:
+                continue
+            if longest is None:
+                result.append(route)
+                if len(result) == self.limit:
+                    break
+                continue
+            for address in longest.subnets(prefix):
+                length, matches = best.get(address, (-1, []))
+                if prefix[2] > length:
+                    best[address] = (prefix[2], [(position, route)])
+                elif prefix[2] == length: # Equal cost routes
+                    matches.append((position, route))
+        if longest is not None:
+            matches = dict(match for _, found in best.values() for match in found)
+            result = [matches[position] for position in sorted(matches)]
+            if self.limit:
+                result = result[:self.limit]
+        return result
+
+
+def stream_routes(engine, chunk_size=65536):
+    """
+    Stream the routing table of the engine. The response is read in chunks
+    and decoded one route at a time. smc-python requests cannot be
+    streamed, so the request is sent with the requests session of smc and
+    handled like Engine.routing_monitoring: an expired session is
+    refreshed and the request sent again, and failures raise
+    EngineCommandFailed.
+
+    :param Engine engine: engine
+    :param int chunk_size: bytes read from the response at a time
+    :raises EngineCommandFailed: routes cannot be retrieved
+    :return: generator of route entries
+    """
+    href = engine.get_relation('routing_monitoring')
+    response = None
+    try:
+        for retry in (True, False):
+            transport = session.session
+            response = transport.get(
+                href,
+                headers={'Accept': 'application/json'},
+                timeout=session.timeout,
+                stream=True)
+            if response.status_code == 401 and retry:
+                response.close()
+                with refresh_lock:
+                    # Another engine may have refreshed the session already
+                    if session.session is transport:
+                        session.refresh()
+                continue
+            if response.status_code != 200:
+                raise EngineCommandFailed(
+                    SMCOperationFailure(response).smcresult.msg)
+            break
+        for route in iter_json_array(
+            response.iter_content(chunk_size), 'routing_monitoring_entry'):
+            route.pop('cluster_ref', None)
+            yield route
+    except requests.exceptions.RequestException:
+        raise EngineCommandFailed('Timed out waiting for routes')
+    finally:
+        if response is not None:
+            response.close()
+
+
+def route_key(route):
+    """
+    Snapshot entry of a route. Entries sort by network, then prefix length,
+    gateway, route type and destination interface.
+
+    :param dict route: route entry
+    :raises ValueError: invalid route network
+    :return: tuple of (ip version, network as int, prefix length, gateway,
+        route type, dst_if)
+    """
+    family, network, length = parse_prefix(
+        route.get('route_network'), route.get('route_netmask'))
+    dst_if = route.get('dst_if')
+    return (4 if family == socket.AF_INET else 6, network, length,
+            route.get('route_gateway') or '', route.get('route_type') or '',
+            -1 if dst_if is None else dst_if)
+
+
+def route_from_key(key):
+    """
+    Route dict of a snapshot entry returned by :func:`route_key`
+    """
+    version, network, length, gateway, route_type, dst_if = key
+    family = socket.AF_INET if version == 4 else socket.AF_INET6
+    packed = codecs.decode('%0*x' % (PrefixTrie.bits[family] // 4, network), 'hex')
+    return dict(
+        route_gateway=gateway or None,
+        route_type=route_type or None,
+        route_netmask=length,
+        dst_if=None if dst_if == -1 else dst_if,
+        route_network=socket.inet_ntop(family, packed))
+
+
+def snapshot_path(directory, name):
+    return os.path.join(directory, re.sub(r'[^\w.-]', '_', name) + '.json')
+
+
+def read_snapshot(directory, name):
+    """
+    Sorted snapshot entries of the engine saved in directory
+
+    :raises IOError: no snapshot for the engine
+    :rtype: list(tuple)
+    """
+    with open(snapshot_path(directory, name)) as f:
+        return [tuple(key) for key in json.load(f)['routes']]
+
+
+def write_snapshot(directory, name, keys):
+    """
+    Save the sorted snapshot entries of the engine in directory. The file
+    is replaced once written so a failed run does not leave a partial
+    snapshot.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = snapshot_path(directory, name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dict(engine=name, routes=keys), f, separators=(',', ':'))
+    os.rename(path + '.tmp', path)
+
+
+def diff_routes(old, new):
+    """
+    Routes added and withdrawn between two sorted snapshots, compared in a
+    single pass over both.
+
+    :param list old: sorted snapshot entries
+    :param list new: sorted snapshot entries
+    :return: tuple of (added, withdrawn) snapshot entries
+    """
+    added, withdrawn = [], []
+    i = j = 0
+    while i < len(old) and j < len(new):
+        if old[i] == new[j]:
+            i += 1
+            j += 1
+        elif old[i] < new[j]:
+            withdrawn.append(old[i])
+            i += 1
+        else:
+            added.append(new[j])
+            j += 1
+    withdrawn.extend(old[i:])
+    added.extend(new[j:])
+    return added, withdrawn
     
     
 class RoutingFacts(StonesoftModuleBase):
     def __init__(self):
         
         self.module_args = dict(
-            filter=dict(type='str', required=True)
+            filter=dict(type='str'),
+            engines=dict(type='list'),
+            snapshot_dir=dict(type='str'),
+            compare_to=dict(type='str'),
+            longest_match=dict(type='list'),
+            contains=dict(type='list'),
+            within=dict(type='list'),
+            overlaps=dict(type='list'),
+            route_type=dict(type='list'),
+            limit=dict(default=0, type='int')
         )
         
+        mutually_exclusive = [
+            ['filter', 'engines']
+        ]
+        
+        required_one_of = [
+            ['filter', 'engines']
+        ]
+        
         self.filter = None
+        self.engines = None
+        self.snapshot_dir = None
+        self.compare_to = None
+        self.longest_match = None
+        self.contains = None
+        self.within = None
+        self.overlaps = None
+        self.route_type = None
+        self.limit = None
         
         self.results = dict(
             ansible_facts=dict(
                 routes=[]
             )
         )
-        super(RoutingFacts, self).__init__(self.module_args)
+        super(RoutingFacts, self).__init__(self.module_args,
+            mutually_exclusive=mutually_exclusive,
+            required_one_of=required_one_of)
 
     def exec_module(self, **kwargs):
         for name, value in kwargs.items():
             setattr(self, name, value)
         
-        elements = []
         try:
-            engine = Engine(self.filter)
-            elements = [route_dict_from_obj(element) for element in engine.routing_monitoring]
+            query = RouteQuery(
+                longest_match=self.longest_match, contains=self.contains,
+                within=self.within, overlaps=self.overlaps,
+                route_type=self.route_type, limit=self.limit)
+        except ValueError as err:
+            self.fail(msg=str(err))
+        
+        names = self.engines or [self.filter]
+        cache = Cache(max_concurrency=self.smc_max_concurrency)
+        
+        def engine_routes(engine):
+            routes = query.run(stream_routes(engine))
+            keys = None
+            if self.snapshot_dir or self.compare_to:
+                keys = sorted(route_key(route) for route in routes)
+            return routes, keys
+        
+        try:
+            cache.add({'engine': names})
+            if cache.missing:
+                self.fail(
+                    msg='Specified engine was not found: {}. Called from: {}'
+                    .format(', '.join(m['name'] for m in cache.missing),
+                        self.__class__.__name__))
+            
+            if self.compare_to:
+                previous = {}
+                for name in names:
+                    try:
+                        previous[name] = read_snapshot(self.compare_to, name)
+                    except (IOError, OSError):
+                        self.fail(msg='No snapshot of engine {} in {}'.format(
+                            name, self.compare_to))
+            
+            engines = [cache.get('engine', name) for name in names]
+            results = cache._map(engine_routes, engines)
+            
+            facts = {}
+            if self.compare_to:
+                changes = {}
+                for name, (_, keys) in zip(names, results):
+                    added, withdrawn = diff_routes(previous[name], keys)
+                    changes[name] = dict(
+                        added=[route_from_key(key) for key in added],
+                        withdrawn=[route_from_key(key) for key in withdrawn])
+                facts['route_changes'] = changes
+            elif self.engines:
+                facts['engine_routes'] = dict(
+                    (name, [route_dict_from_obj(route) for route in routes])
+                    for name, (routes, _) in zip(names, results))
+            else:
+                facts['routes'] = [route_dict_from_obj(route)
+                    for route in results[0][0]]
+            
+            if self.snapshot_dir:
+                for name, (_, keys) in zip(names, results):
+                    write_snapshot(self.snapshot_dir, name, keys)
             
-        except SMCException as err:
+        except (SMCException, ValueError, IOError, OSError) as err:
             self.fail(msg=str(err), exception=traceback.format_exc())
         
-        self.results['ansible_facts'] = {'routes': elements}
+        self.results['ansible_facts'] = facts
         return self.results
 
 def main():
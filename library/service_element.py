@@ -586,7 +586,7 @@ class ServiceElement(StonesoftModuleBase):
                     to_be_created.setdefault(typeof, set()).add(
                         values.get('name'))
 
-        cache = Cache()
+        cache = Cache(max_concurrency=self.smc_max_concurrency)
         for group in groups:
             for _, values in group.items():
                 members = {} if values.get('members') is None else values['members']
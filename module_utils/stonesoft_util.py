@@ -3,25 +3,265 @@ Base spec for Stonesoft Management Center connections. This is a session
 that will be re-used for multiple operations against the management
 server.
 """
+import os
+import json
+import time
+import hashlib
 import inspect
+import tempfile
 import traceback
+import collections
 from ansible.module_utils.basic import AnsibleModule
 
 
 try:
+    import requests
+    import smc
     from smc import session
+    from smc.api.session import load_entry_points
+    from smc.api.entry_point import Resource
     import smc.elements.network as network
     import smc.elements.netlink as netlink
     import smc.elements.group as group
     import smc.elements.service as service
     from smc.core.engine import Engine
     from smc.base.collection import Search
+    from smc.base.model import Element
     from smc.elements.other import Category
     from smc.api.exceptions import ConfigLoadError, SMCException, \
         UserElementNotFound, ElementNotFound, DeleteElementFailed
     HAS_LIB = True
 except ImportError:
     HAS_LIB = False
+
+
+class SessionBroker(object):
+    """
+    Opt-in store for SMC sessions that allows a session to be re-used
+    across module runs instead of performing a login and logout for every
+    task. Sessions are stored on the local file system, keyed by a hash of
+    the SMC address, domain and api key, and are considered valid for `ttl`
+    seconds after the last task released them.
+    
+    If a stored session has expired on the SMC side, the first request will
+    return a 401 and smc-python will refresh the session by performing a new
+    login with the same credentials. The refreshed session then replaces the
+    stored session when it is released.
+    
+    smc-python has no public API to attach an existing session, so the
+    broker sets the session internals directly. If the installed version
+    does not have them, the cache is not used and a normal login is done.
+    
+    :param str path: directory to store session files
+    :param int ttl: time in seconds a released session is re-usable
+    """
+    def __init__(self, path=None, ttl=600):
+        self.path = os.path.expanduser(path or '~/.ansible/tmp/stonesoft')
+        self.ttl = ttl
+        self.key = None
+    
+    @staticmethod
+    def session_key(params):
+        """
+        Key for the session file. The api key is only used as part of the
+        hash and never stored.
+        
+        :param dict params: module params with SMC connection information
+        :rtype: str
+        """
+        key = '|'.join([
+            params.get('smc_address') or '',
+            params.get('smc_domain') or '',
+            params.get('smc_api_key') or '',
+            params.get('smc_api_version') or ''])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def supported():
+        """
+        Check that the smc-python session and session manager have the
+        internals used to attach and detach a stored session.
+        
+        :rtype: bool
+        """
+        try:
+            manager = session.manager
+        except Exception:
+            return False
+        return all(hasattr(session, attr)
+                   for attr in ('_params', '_session', '_resource')) and \
+            isinstance(getattr(manager, '_sessions', None), dict) and \
+            callable(getattr(manager, '_deregister', None))
+    
+    @property
+    def filename(self):
+        return os.path.join(self.path, 'session-%s.json' % self.key)
+    
+    def _read(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+    
+    def _write(self, data):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, 0o700)
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.chmod(tmp, 0o600)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    
+    def acquire(self, params):
+        """
+        Attach a previously stored session to the smc-python session if one
+        exists for these credentials and has not expired.
+        
+        :param dict params: module params with SMC connection information
+        :return: True if a stored session was re-used, False if a login is
+            still required
+        :rtype: bool
+        """
+        if not params.get('smc_address') or not params.get('smc_api_key'):
+            return False
+        if not self.supported():
+            return False
+        
+        self.key = self.session_key(params)
+        cached = self._read()
+        if not cached or cached.get('expires', 0) < time.time():
+            self.invalidate()
+            return False
+        
+        extra_args = dict(params.get('smc_extra_args') or {})
+        verify = extra_args.pop('verify', True)
+        extra_args.pop('retry_on_busy', None)
+        
+        session._params = dict(
+            url=params.get('smc_address'),
+            api_key=params.get('smc_api_key'),
+            api_version=cached['api_version'],
+            timeout=params.get('smc_timeout'),
+            domain=params.get('smc_domain'),
+            verify=verify,
+            kwargs=extra_args)
+        session._session = requests.session()
+        session._session.verify = verify
+        session._session.cookies.update(cached['cookies'])
+        if cached.get('entry_points'):
+            session._resource = Resource(cached['entry_points'])
+        else:
+            load_entry_points(session)
+        # Register directly by key, registering by name would require
+        # fetching the current admin user from the SMC
+        session.manager._sessions[self.key] = session
+        return True
+    
+    def release(self):
+        """
+        Store the current session for re-use by subsequent tasks. The session
+        is removed from the smc-python session manager so it is not logged
+        out when the interpreter exits.
+        """
+        if not self.key:
+            return
+        if session.is_active:
+            self._write(dict(
+                api_version=session.api_version,
+                cookies=session.session.cookies.get_dict(),
+                entry_points=getattr(session._resource, '_entry_points', None),
+                expires=time.time() + self.ttl))
+        else:
+            self.invalidate()
+        session.manager._deregister(session)
+        session._session = None
+    
+    def invalidate(self):
+        """
+        Remove the stored session, for example after a failed login.
+        """
+        if self.key and os.path.exists(self.filename):
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+    
+
+class SessionMetrics(object):
+    """
+    Opt-in metrics for the requests made to the SMC by a module run. The
+    metrics are collected by a response hook on the requests session used
+    by smc-python and returned in the module result when `smc_metrics` is
+    set.
+    
+    :param float login_time: seconds taken to log in or restore a session
+    """
+    def __init__(self, login_time=None):
+        self.login_time = login_time
+        self.by_method = collections.Counter()
+        self.by_entry_point = collections.Counter()
+        self.latencies = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+    
+    def install(self, transport):
+        """
+        Record requests made through the requests session
+        
+        :param requests.Session transport: session used by smc-python
+        """
+        transport.hooks['response'].append(self.record)
+    
+    def record(self, response, *args, **kwargs):
+        request = response.request
+        self.by_method[request.method] += 1
+        self.by_entry_point[self.entry_point(request.url)] += 1
+        self.latencies.append(response.elapsed.total_seconds())
+        if request.body:
+            self.bytes_sent += len(request.body)
+        # Streamed responses such as exports are not read here
+        if not kwargs.get('stream'):
+            self.bytes_received += len(response.content or b'')
+    
+    @staticmethod
+    def entry_point(url):
+        """
+        Entry point of the request without the API version and element ids,
+        i.e. elements/host or elements/single_fw/routing.
+        
+        :rtype: str
+        """
+        path = url.split('?')[0].split('://', 1)[-1].split('/')[1:]
+        if path and path[0].replace('.', '').isdigit():
+            path = path[1:]
+        return '/'.join(part for part in path if part and not part.isdigit())
+    
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        index = int(round(percent / 100.0 * len(latencies) + 0.5)) - 1
+        return latencies[min(max(index, 0), len(latencies) - 1)]
+    
+    def as_dict(self):
+        return dict(
+            requests=len(self.latencies),
+            by_method=dict(self.by_method),
+            by_entry_point=dict(self.by_entry_point),
+            latency=dict(
+                total=round(sum(self.latencies), 4),
+                p50=round(self.percentile(50), 4),
+                p90=round(self.percentile(90), 4),
+                p99=round(self.percentile(99), 4),
+                max=round(max(self.latencies or [0]), 4)),
+            bytes_sent=self.bytes_sent,
+            bytes_received=self.bytes_received,
+            login_time=round(self.login_time or 0, 4))
     
 
 class Cache(object):
@@ -31,11 +271,26 @@ class Cache(object):
     is not intended to have a `get_or_create` logic, therefore when
     validating the existence of elements, you should check missing
     before continuing the playbook run.
+    
+    Elements are indexed by typeof and name as well as by href so
+    lookups do not depend on the number of cached elements.
+    
+    :param int bulk_threshold: number of names of a single type that
+        triggers fetching the type listing instead of a search per name
+    :param int max_concurrency: max number of searches to run in parallel
+        for elements that are resolved by name. Results are stored in the
+        order the elements were requested regardless of the completion order.
     """
     
-    def __init__(self):
+    def __init__(self, bulk_threshold=20, max_concurrency=1):
         self.missing = []
         self.cache = {} # typeof: [Element1, Element2, ..]
+        self._by_name = {} # typeof: {name: Element}
+        self._by_href = {} # href: Element
+        # Number of names of a single type that triggers fetching
+        # the full entry point listing instead of a query per name
+        self.bulk_threshold = bulk_threshold
+        self.max_concurrency = max_concurrency or 1
         
     def add_many(self, list_of_entries):
         """
@@ -47,10 +302,10 @@ class Cache(object):
         Where the key is a valid 'typeof' (SMC entry point)
         and value is a list of names to search
         """
-        for elements in list_of_entries:
-            for typeof, values in elements.items():
-                for name in values:
-                    self._add_entry(typeof, name)
+        self._add_entries([(typeof, name)
+            for elements in list_of_entries
+            for typeof, values in elements.items()
+            for name in values])
                 
     def add(self, dict_of_entries):
         """
@@ -58,57 +313,137 @@ class Cache(object):
         
             element = {'network': [network1,network2]}
         """
-        for typeof, values in dict_of_entries.items():
-            for name in values:
-                self._add_entry(typeof, name)
+        self._add_entries([(typeof, name)
+            for typeof, values in dict_of_entries.items()
+            for name in values])
+    
+    def _add_entries(self, entries):
+        """
+        Resolve a list of (typeof, name) tuples. Names not already cached
+        are grouped by type and when a type has at least `bulk_threshold`
+        names, the type listing is retrieved once and matched locally
+        instead of searching for each name. Remaining names are searched
+        using up to `max_concurrency` threads.
+        Elements and missing entries are added in the order provided.
+        """
+        pending = {}
+        for typeof, name in entries:
+            if not self.get(typeof, name):
+                pending.setdefault(typeof, set()).add(name)
+        
+        listed = set()
+        for typeof, names in pending.items():
+            if self.bulk_threshold and len(names) >= self.bulk_threshold:
+                self._add_bulk(typeof, names)
+                listed.add(typeof)
+        
+        lookups = []
+        for typeof, name in entries:
+            if typeof not in listed and name in pending.get(typeof, ()):
+                lookups.append((typeof, name))
+                pending[typeof].discard(name)
+        found = dict(zip(lookups, self._map(self._lookup, lookups)))
+        
+        for typeof, name in entries:
+            if self.get(typeof, name):
+                continue
+            result = found.get((typeof, name))
+            if result:
+                self._store(typeof, result)
+            else:
+                self.missing.append(
+                    dict(msg='Cannot find specified element',
+                         name=name,type=typeof))
+    
+    def _add_bulk(self, typeof, names):
+        # Fetch all elements of this type and keep the ones requested
+        wanted = set(names)
+        for result in self._search(typeof):
+            if result.name in wanted:
+                self._store(typeof, result)
+                wanted.discard(result.name)
+                if not wanted:
+                    break
+    
+    def _search(self, typeof):
+        if typeof == 'engine':
+            return Search.objects.context_filter('engine_clusters')
+        return Search.objects.entry_point(typeof)
+    
+    def _lookup(self, typeof_and_name):
+        typeof, name = typeof_and_name
+        return self._search(typeof).filter(name, exact_match=True).first()
+    
+    def _map(self, func, items):
+        """
+        Map func over items using at most `max_concurrency` threads.
+        Results are returned in the same order as items.
+        """
+        if self.max_concurrency <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        # Imported here as multiprocessing is only needed for concurrent runs
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(self.max_concurrency, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            # Workers exit on their own once the pool is closed. Joining
+            # would wait up to 0.1s for the pool handler threads to poll.
+            pool.close()
+    
+    def _store(self, typeof, element):
+        # Keep the first element found for a given name, as a
+        # linear search of the type list would return
+        self.cache.setdefault(typeof, []).append(element)
+        self._by_name.setdefault(typeof, {}).setdefault(element.name, element)
+        self._by_href.setdefault(element.href, element)
     
     def _add_user_entries(self, typeof, users):
         # User elements are fetched by direct href
-        domain_dict = {}
+        domain_dict = collections.OrderedDict()
         for user in users:
             _user, _domain = user.split(',domain=')
             domain_dict.setdefault(_domain, []).append(_user)
         
         func = 'get_groups' if typeof == 'groups' else 'get_users'
-    
-        for domain, uids in domain_dict.items():
-            # Get domain first
-            entry_point = 'external_ldap_user_domain' if domain != \
-                'InternalDomain' else 'internal_user_domain'
-            
-            ldap = Search.objects.entry_point(entry_point)\
-                .filter(domain, exact_match=True).first()
-
+        
+        # Get domains first
+        domains = [('external_ldap_user_domain' if domain != 'InternalDomain'
+                    else 'internal_user_domain', domain) for domain in domain_dict]
+        
+        lookups = []
+        for (entry_point, domain), ldap in zip(domains, self._map(self._lookup, domains)):
             if not ldap:
                 self.missing.append(
                     dict(msg='Cannot find specified element',
                          name=domain,
                          type=entry_point))
                 continue
-            for uid in uids:
-                try:
-                    result = getattr(ldap, func)([uid])
-                    self.cache.setdefault('user_element', []).extend(
-                        result)
-                except UserElementNotFound as e:
-                    self.missing.append(
-                        dict(msg='Cannot find specified element: %s' % str(e),
-                             name=uid,
-                             type=typeof))
+            lookups.extend((ldap, uid) for uid in domain_dict[domain])
+        
+        def get_user(ldap_and_uid):
+            ldap, uid = ldap_and_uid
+            try:
+                return getattr(ldap, func)([uid]), None
+            except UserElementNotFound as e:
+                return [], str(e)
+        
+        for (_, uid), (result, error) in zip(lookups, self._map(get_user, lookups)):
+            if error is not None:
+                self.missing.append(
+                    dict(msg='Cannot find specified element: %s' % error,
+                         name=uid,
+                         type=typeof))
+            for user in result:
+                self._store('user_element', user)
             
     def _add_entry(self, typeof, name):
         # Add entry if it doesn't already exist
         if self.get(typeof, name):
             return
-        if typeof == 'engine':
-            result = Search.objects.context_filter('engine_clusters')\
-                .filter(name, exact_match=True).first()
-        else:
-            result = Search.objects.entry_point(typeof)\
-                .filter(name, exact_match=True).first()
+        result = self._lookup((typeof, name))
         if result:
-            self.cache.setdefault(typeof, []).append(
-                result)
+            self._store(typeof, result)
         else:
             self.missing.append(
                 dict(msg='Cannot find specified element',
@@ -122,9 +457,42 @@ class Cache(object):
         :param str name: name of element
         :rtype: element or None
         """
-        for value in self.cache.get(typeof, []):
-            if value.name == name:
-                return value
+        return self._by_name.get(typeof, {}).get(name)
+    
+    def get_by_href(self, href):
+        """
+        Get element by href
+        
+        :param str href: href of element
+        :rtype: element or None
+        """
+        return self._by_href.get(href)
+    
+    def get_href(self, href):
+        """
+        Get element by href, fetching the element from the SMC if it
+        is not already cached.
+        
+        :param str href: href of element
+        :rtype: element or None
+        """
+        element = self._by_href.get(href)
+        if element is None:
+            element = Element.from_href(href)
+            if element is not None:
+                self._store(element.typeof, element)
+        return element
+    
+    def add_type(self, typeof):
+        """
+        Add all elements of a specific type using a single listing of
+        the entry point. Only element metadata is retrieved.
+        
+        :param str typeof: typeof element
+        """
+        for element in self._search(typeof):
+            if element.href not in self._by_href:
+                self._store(typeof, element)
     
     def get_type(self, typeof):
         """
@@ -146,87 +514,246 @@ class Cache(object):
         return out
 
 
+class CategoryIndex(Cache):
+    """
+    Index of category tags and the elements they are assigned to. The
+    index is built from one listing of the category tags and one search
+    per category tag, run by up to `max_concurrency` threads. Referenced
+    elements are known by their search metadata only (name, type and
+    href) and are never loaded.
+
+    Query the elements of a category with :meth:`elements` and the
+    categories of an element with :meth:`categories`. The reverse lookup
+    only knows about the categories the index was built with.
+    """
+    def __init__(self, **kwargs):
+        super(CategoryIndex, self).__init__(**kwargs)
+        self.members = collections.OrderedDict() # category href: [Element, ..]
+        self.tags = {} # element href: [Category, ..]
+
+    def build(self, categories=None):
+        """
+        Index the elements of the given categories
+
+        :param list categories: categories to index, all categories if None
+        :return: self
+        """
+        if categories is None:
+            categories = Category.objects.all()
+        categories = list(categories)
+        for category, elements in zip(categories, self._map(
+            lambda category: category.search_elements(), categories)):
+            self._store(category.typeof, category)
+            self.members[category.href] = elements
+            for element in elements:
+                self.tags.setdefault(element.href, []).append(category)
+        return self
+
+    def elements(self, category):
+        """
+        Elements assigned to the category
+
+        :param category: category element or href
+        :rtype: list(Element)
+        """
+        return self.members.get(getattr(category, 'href', category), [])
+
+    def categories(self, element):
+        """
+        Categories assigned to the element
+
+        :param element: element or href
+        :rtype: list(Category)
+        """
+        return self.tags.get(getattr(element, 'href', element), [])
+
+
+try:
+    getargspec = inspect.getfullargspec
+except AttributeError: # Python 2
+    getargspec = inspect.getargspec
+
+
+# Default location of the constructor arguments written by install.py
+TYPE_ATTRS_PATH = os.path.join('~', '.ansible', 'tmp', 'stonesoft', 'types.json')
+
+_type_attrs = {} # type dict name: {typeof: (arg1, arg2, ..)}
+
+
 def required_args(clazz):
-    argspec = inspect.getargspec(clazz.create)
+    argspec = getargspec(clazz.create)
     if argspec.defaults:
         args = argspec.args[:-len(argspec.defaults)]
         return args[1:]
     return argspec.args[1:]
 
+
+def _element_types():
+    return dict(
+        host=network.Host,
+        network=network.Network,
+        address_range=network.AddressRange,
+        router=network.Router,
+        ip_list=network.IPList,
+        group=group.Group,
+        netlink=netlink.StaticNetlink,
+        interface_zone=network.Zone,
+        domain_name=network.DomainName)
+
+
+def _ro_element_types():
+    return dict(
+        alias=network.Alias,
+        country=network.Country,
+        expression=network.Expression,
+        engine=Engine)
+
+
+def _service_types():
+    return dict(
+        tcp_service=service.TCPService,
+        udp_service=service.UDPService,
+        ip_service=service.IPService,
+        ethernet_service=service.EthernetService,
+        icmp_service=service.ICMPService,
+        icmp_ipv6_service=service.ICMPIPv6Service,
+        service_group=group.ServiceGroup,
+        tcp_service_group=group.TCPServiceGroup,
+        udp_service_group=group.UDPServiceGroup,
+        ip_service_group=group.IPServiceGroup,
+        icmp_service_group=group.ICMPServiceGroup)
+
+
+def _ro_service_types():
+    return dict(
+        url_category=service.URLCategory,
+        application_situation=service.ApplicationSituation,
+        protocol=service.Protocol,
+        rpc_service=service.RPCService)
+
+
+# Type dict name: (function returning typeof: class, constructor method)
+TYPE_DICTS = collections.OrderedDict([
+    ('element', (_element_types, 'create')),
+    ('ro_element', (_ro_element_types, '__init__')),
+    ('service', (_service_types, 'create')),
+    ('ro_service', (_ro_service_types, '__init__'))])
+
+
+def type_attrs_path():
+    return os.path.expanduser(
+        os.environ.get('STONESOFT_TYPE_ATTRS', TYPE_ATTRS_PATH))
+
+
+def load_type_attrs(path=None):
+    """
+    Load constructor arguments written by :func:`write_type_attrs`. The
+    file is ignored if it was generated for another smc-python version.
     
-def element_type_dict(map_only=False):
-    """ 
-    Type dict constructed with valid `create` constructor arguments.
-    This is used in modules that support update_or_create operations
+    :param str path: path of the json file, defaults to the environment
+        variable STONESOFT_TYPE_ATTRS or TYPE_ATTRS_PATH
+    :return: dict of type dict name: {typeof: [args]}
+    :rtype: dict
+    """
+    try:
+        with open(path or type_attrs_path()) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get('smc_version') != smc_version():
+        return {}
+    return data.get('types', {})
+
+
+def write_type_attrs(path=None):
+    """
+    Introspect the constructor arguments of all type dicts and write them
+    to a json file so modules can skip introspecting smc-python classes.
+    Used by install.py.
+    
+    :param str path: path of the json file, defaults to the environment
+        variable STONESOFT_TYPE_ATTRS or TYPE_ATTRS_PATH
+    :return: path of the file written
+    """
+    path = path or type_attrs_path()
+    types = {}
+    for name in TYPE_DICTS:
+        try:
+            types[name] = dict((typeof, list(args))
+                for typeof, args in _introspect(name).items())
+        except AttributeError: # Class not available in this smc-python version
+            pass
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(dict(smc_version=smc_version(), types=types), f,
+            indent=2, sort_keys=True)
+    return path
+
+
+def smc_version():
+    return smc.__version__
+
+
+def _introspect(name):
+    classes, method = TYPE_DICTS[name]
+    return dict((typeof, tuple(getargspec(getattr(clazz, method)).args[1:]))
+        for typeof, clazz in classes().items())
+
+
+def type_dict(name, map_only=False):
     """
-    types = dict(
-        host=dict(type=network.Host),
-        network=dict(type=network.Network),
-        address_range=dict(type=network.AddressRange),
-        router=dict(type=network.Router),
-        ip_list=dict(type=network.IPList),
-        group=dict(type=group.Group),
-        netlink=dict(type=netlink.StaticNetlink),
-        interface_zone=dict(type=network.Zone),
-        domain_name=dict(type=network.DomainName))
+    Type dict of the given name, i.e. 'element' or 'service'. Constructor
+    arguments are read from the file written by install.py if it exists,
+    otherwise the classes are introspected. Either way this is done once
+    per process. A new dict is returned on each call so callers can
+    merge type dicts without modifying the registry.
     
+    :param str name: name of the type dict in TYPE_DICTS
+    :param bool map_only: only return the typeof to class mapping
+    :return: dict of typeof: dict(type=class, attr=(arg1, ..))
+    :rtype: dict
+    """
+    classes, _ = TYPE_DICTS[name]
+    types = dict((typeof, dict(type=clazz)) for typeof, clazz in classes().items())
     if map_only:
         return types
     
-    for t in types.keys():
-        clazz = types.get(t)['type']
-        types[t]['attr'] = inspect.getargspec(clazz.create).args[1:]
-        #types[t]['attr'] = required_args(clazz)
+    attrs = _type_attrs.get(name)
+    if attrs is None:
+        attrs = dict((typeof, tuple(args))
+            for typeof, args in load_type_attrs().get(name, {}).items())
+        if set(attrs) != set(types):
+            attrs = _introspect(name)
+        _type_attrs[name] = attrs
     
+    for typeof, value in types.items():
+        value['attr'] = attrs[typeof]
     return types
 
+    
+def element_type_dict(map_only=False):
+    """ 
+    Type dict constructed with valid `create` constructor arguments.
+    This is used in modules that support update_or_create operations
+    """
+    return type_dict('element', map_only)
+
 
 def ro_element_type_dict(map_only=False):
     """
     Type dict of read-only network elements. These elements can be
     fetched but not created
     """
-    types = dict(
-        alias=dict(type=network.Alias),
-        country=dict(type=network.Country),
-        expression=dict(type=network.Expression),
-        engine=dict(type=Engine))
-
-    if map_only:
-        return types
-    
-    for t in types.keys():
-        clazz = types.get(t)['type']
-        types[t]['attr'] = inspect.getargspec(clazz.__init__).args[1:]
-    
-    return types
+    return type_dict('ro_element', map_only)
 
 
 def service_type_dict(map_only=False):
     """
     Type dict for serviec elements and groups.
     """
-    types = dict(
-        tcp_service=dict(type=service.TCPService),
-        udp_service=dict(type=service.UDPService),
-        ip_service=dict(type=service.IPService),
-        ethernet_service=dict(type=service.EthernetService),
-        icmp_service=dict(type=service.ICMPService),
-        icmp_ipv6_service=dict(type=service.ICMPIPv6Service),
-        service_group=dict(type=group.ServiceGroup),
-        tcp_service_group=dict(type=group.TCPServiceGroup),
-        udp_service_group=dict(type=group.UDPServiceGroup),
-        ip_service_group=dict(type=group.IPServiceGroup),
-        icmp_service_group=dict(type=group.ICMPServiceGroup))
-    
-    if map_only:
-        return types
-    
-    for t in types.keys():
-        clazz = types.get(t)['type']
-        types[t]['attr'] = inspect.getargspec(clazz.create).args[1:]
-    
-    return types
+    return type_dict('service', map_only)
 
 
 def ro_service_type_dict():
@@ -234,26 +761,18 @@ def ro_service_type_dict():
     Type dict of read-only service elements. These elements can be
     fetched but not created
     """
-    types = dict(
-        url_category=dict(type=service.URLCategory),
-        application_situation=dict(type=service.ApplicationSituation),
-        protocol=dict(type=service.Protocol),
-        rpc_service=dict(type=service.RPCService))
-    
-    for t in types.keys():
-        clazz = types.get(t)['type']
-        types[t]['attr'] = inspect.getargspec(clazz.__init__).args[1:]
-    
-    return types
+    return type_dict('ro_service')
 
                 
-def update_or_create(element, type_dict, check_mode=False):
+def update_or_create(element, type_dict, check_mode=False, cache=None):
     """
     Update or create the element specified. Set check_mode to only
     perform a get against the element versus an actual action.
     
     :param dict element: element dict, key is typeof element and values
     :param dict type_dict: type dict mappings to get class mapping
+    :param Cache cache: optional cache to store the resulting element in,
+        so elements created later in the run can reference it by name
     :param str hint: element attribute to use when finding the element
     :raises CreateElementFailed: may fail due to duplicate name or other
     :raises ElementNotFound: if fetch and element doesn't exist
@@ -301,7 +820,10 @@ def update_or_create(element, type_dict, check_mode=False):
                     result['msg'] = 'Specified element does not exist and parameters did not exist to create'
                 else:
                     result['action'] = 'fetched'
-                
+
+            if cache is not None and element is not None:
+                cache._store(typeof, element)
+
         return result
 
 
@@ -382,7 +904,10 @@ def smc_argument_spec():
         smc_domain=dict(type='str'),
         smc_alt_filepath=dict(type='str'),
         smc_extra_args=dict(type='dict'),
-        smc_logging=dict(type='dict')
+        smc_logging=dict(type='dict'),
+        smc_metrics=dict(default=False, type='bool'),
+        smc_session_cache=dict(type='dict'),
+        smc_max_concurrency=dict(default=1, type='int')
     )
 
 
@@ -424,7 +949,14 @@ class StonesoftModuleBase(object):
             self.module.fail_json(msg='Could not import smc-python required by this module')
         
         self.check_mode = self.module.check_mode
+        self.broker = None
+        self.metrics = None
+        
+        start = time.time()
         self.connect(self.module.params)
+        if self.module.params.get('smc_metrics'):
+            self.metrics = SessionMetrics(login_time=time.time() - start)
+            self.metrics.install(session.session)
             
         result = self.exec_module(**self.module.params)
         self.success(**result)
@@ -446,6 +978,13 @@ class StonesoftModuleBase(object):
                     log_level=params['smc_logging'].get('level', 10),
                     path=params['smc_logging']['path'])
             
+            if params.get('smc_session_cache') is not None:
+                self.broker = SessionBroker(
+                    path=params['smc_session_cache'].get('path'),
+                    ttl=int(params['smc_session_cache'].get('ttl', 600)))
+                if self.broker.acquire(params):
+                    return
+            
             if 'smc_address' and 'smc_api_key' in params:    
                 extra_args = params.get('smc_extra_args')
                 # When connection parameters are defined, alt_filepath is ignored.
@@ -464,12 +1003,19 @@ class StonesoftModuleBase(object):
                 session.login()
         
         except (ConfigLoadError, SMCException) as err:
+            if self.broker:
+                self.broker.invalidate()
             self.fail(msg=str(err), exception=traceback.format_exc())
 
     def disconnect(self):
         """
-        Disconnect session from SMC after ansible run
+        Disconnect session from SMC after ansible run. If a session cache
+        is in use, the session is released for the next task instead of
+        being logged out.
         """
+        if self.broker and self.broker.key:
+            self.broker.release()
+            return
         try:
             session.logout()
         except SMCException:
@@ -589,6 +1135,8 @@ class StonesoftModuleBase(object):
         Fail the request with message
         """
         self.disconnect()
+        if self.metrics:
+            kwargs.update(smc_metrics=self.metrics.as_dict())
         self.module.fail_json(msg=msg, **kwargs)
         
     def success(self, **result):
@@ -596,6 +1144,8 @@ class StonesoftModuleBase(object):
         Success with result messages
         """
         self.disconnect()
+        if self.metrics:
+            result.update(smc_metrics=self.metrics.as_dict())
         self.module.exit_json(**result)
         
     def is_element_valid(self, element, type_dict, check_required=True):
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# Build slim runtime variants of the modules
+
+"""
+Ansible sends each module and stonesoft_util to the target for every
+task. Most of each module is its DOCUMENTATION, EXAMPLES and RETURN
+strings, which are only used by ansible-doc. This helper writes copies of
+the modules and stonesoft_util without documentation, docstrings, comments
+and blank lines to build/library and build/module_utils. Point ansible to
+these directories to run the slim variants::
+
+    python slim.py
+    ANSIBLE_LIBRARY=build/library ANSIBLE_MODULE_UTILS=build/module_utils \\
+        ansible-playbook playbooks/engine_facts.yml
+
+Keep using library/ for ansible-doc, the slim modules have no documentation.
+"""
+import io
+import os
+import sys
+import shutil
+import tokenize
+
+
+# Module level variables only used by ansible-doc
+DOC_VARIABLES = ('DOCUMENTATION', 'EXAMPLES', 'RETURN')
+
+SKIP_TOKENS = (tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT,
+    tokenize.COMMENT)
+
+
+def logical_lines(tokens):
+    """
+    Group tokens into logical lines, each ending with a NEWLINE token.
+    """
+    line = []
+    for token in tokens:
+        line.append(token)
+        if token[0] in (tokenize.NEWLINE, tokenize.ENDMARKER):
+            yield line
+            line = []
+    if line:
+        yield line
+
+
+def removable(statement):
+    """
+    Whether the statement is a docstring, a string expression or a module
+    level documentation variable.
+    """
+    if all(token[0] == tokenize.STRING for token in statement):
+        return True
+    return (len(statement) == 3 and statement[0][0] == tokenize.NAME and
+            statement[0][1] in DOC_VARIABLES and statement[0][2][1] == 0 and
+            statement[1][1] == '=' and statement[2][0] == tokenize.STRING)
+
+
+def slim(source):
+    """
+    Remove documentation, docstrings, comments and blank lines from the
+    source of a module. The header comments before the first statement,
+    such as the interpreter line and copyright, are kept.
+
+    :param str source: source of the module
+    :return: source of the slim module
+    :rtype: str
+    """
+    lines = source.splitlines(True)
+    tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    keep = [True] * len(lines)
+    replace = {} # line index: replacement
+    strings = set() # lines continuing a multi line string that is kept
+
+    statements = []
+    header = True
+    for line in logical_lines(tokens):
+        for token in line:
+            if token[0] == tokenize.COMMENT and not header:
+                row, col = token[2][0] - 1, token[2][1]
+                replace[row] = replace.get(row, lines[row])[:col].rstrip() + '\n'
+        statement = [token for token in line if token[0] not in SKIP_TOKENS]
+        if statement:
+            statements.append(statement)
+            header = False
+
+    for index, statement in enumerate(statements):
+        if statement[0][0] == tokenize.ENDMARKER:
+            continue
+        first, last = statement[0][2][0] - 1, statement[-1][3][0] - 1
+        if removable(statement):
+            for row in range(first, last + 1):
+                keep[row] = False
+            # Keep the block valid if the docstring is its only statement
+            indent = statement[0][2][1]
+            if indent and statements[index + 1][0][2][1] < indent:
+                keep[first] = True
+                replace[first] = ' ' * indent + 'pass\n'
+        else:
+            for token in statement:
+                if token[0] == tokenize.STRING and token[2][0] != token[3][0]:
+                    strings.update(range(token[2][0] - 1, token[3][0]))
+
+    output = []
+    for row, line in enumerate(lines):
+        if not keep[row]:
+            continue
+        line = replace.get(row, line)
+        if row not in strings:
+            if not line.strip():
+                continue
+            line = line.rstrip() + '\n'
+        output.append(line)
+    return ''.join(output)
+
+
+def build(src, dest):
+    """
+    Write a slim variant of each python file in src to dest.
+
+    :return: list of (filename, original size, slim size)
+    """
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    sizes = []
+    for filename in sorted(os.listdir(src)):
+        if not filename.endswith('.py'):
+            continue
+        with io.open(os.path.join(src, filename), encoding='utf-8') as f:
+            source = f.read()
+        result = slim(source)
+        # Fail the build rather than ship a module that does not compile
+        compile(result, filename, 'exec')
+        with io.open(os.path.join(dest, filename), 'w', encoding='utf-8') as f:
+            f.write(result)
+        shutil.copymode(os.path.join(src, filename), os.path.join(dest, filename))
+        sizes.append((filename, len(source.encode('utf-8')), len(result.encode('utf-8'))))
+    return sizes
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
+    dest = sys.argv[1] if len(sys.argv) > 1 else os.path.join(here, 'build')
+
+    total, total_slim = 0, 0
+    for directory in ('library', 'module_utils'):
+        for filename, size, slim_size in build(
+                os.path.join(here, directory), os.path.join(dest, directory)):
+            print('%-40s %8d %8d' % (os.path.join(directory, filename), size, slim_size))
+            total += size
+            total_slim += slim_size
+    print('%-40s %8d %8d' % ('total', total, total_slim))
+    print('Slim modules written to: %s' % dest)
+
+
+if __name__ == '__main__':
+    main()